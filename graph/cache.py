@@ -0,0 +1,144 @@
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+from functools import wraps
+
+import networkx as nx
+
+
+logging.basicConfig(
+    filename="logs/graph.log",
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+    force=True,
+)
+
+CACHE_DIR = "data/cache/analytics/"
+CACHE_MAX_BYTES = 512 * 1024**2
+
+
+def fingerprint_graph(g):
+    """
+    Function that returns a content fingerprint of the graph. Nodes and edges are
+    hashed together with their attributes in a sorted order, so the same graph
+    artifact read twice gives the same fingerprint.
+    """
+
+    h = hashlib.sha256()
+    h.update(type(g).__name__.encode())
+    for n, d in sorted(g.nodes(data=True), key=lambda x: str(x[0])):
+        h.update(repr((n, sorted(d.items()))).encode())
+    edges = (
+        (u, v, d) if g.is_directed() or str(u) <= str(v) else (v, u, d)
+        for u, v, d in g.edges(data=True)
+    )
+    for u, v, d in sorted(edges, key=lambda x: (str(x[0]), str(x[1]))):
+        h.update(repr((u, v, sorted(d.items()))).encode())
+
+    return h.hexdigest()
+
+
+def _fingerprint_argument(arg):
+    """Helper function that turns a function argument into a hashable string."""
+
+    if isinstance(arg, nx.Graph):
+        return f"graph:{fingerprint_graph(arg)}"
+    elif isinstance(arg, (list, tuple)):
+        return repr([_fingerprint_argument(a) for a in arg])
+    elif isinstance(arg, dict):
+        return repr(sorted((k, _fingerprint_argument(v)) for k, v in arg.items()))
+
+    return repr(arg)
+
+
+def _fingerprint_function(func):
+    """
+    Helper function that returns the hash of a function's source code, so that
+    the cached results are not used after the function is changed.
+    """
+
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        # the source is not available, e.g. for functions defined interactively
+        source = repr(func.__code__.co_code) + repr(func.__code__.co_consts)
+
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _evict(cache_dir, max_bytes):
+    """
+    Helper function that removes the least recently used cache entries until the
+    total size of the cache folder is below max_bytes.
+    """
+
+    entries = []
+    for file in os.listdir(cache_dir):
+        if file.endswith(".pkl"):
+            stat = os.stat(f"{cache_dir}{file}")
+            entries.append((stat.st_mtime, stat.st_size, file))
+
+    total_size = sum(e[1] for e in entries)
+    for _, size, file in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        os.remove(f"{cache_dir}{file}")
+        total_size -= size
+        logging.debug(f"{file} is evicted from the analytics cache")
+
+
+def memoize_analysis(func=None, cache_dir=None, max_bytes=None):
+    """
+    Decorator that caches the result of a descriptive analytics function on disk.
+    The key is built from the qualified name and the source code of the function,
+    the fingerprint of every graph argument and the rest of the parameters.
+    Entries are evicted in least recently used order when the cache grows over
+    max_bytes. The cache can be bypassed for a call with use_cache=False.
+    """
+
+    if func is None:
+        return lambda f: memoize_analysis(f, cache_dir, max_bytes)
+
+    signature = inspect.signature(func)
+    function_fingerprint = _fingerprint_function(func)
+
+    @wraps(func)
+    def wrapper(*args, use_cache=True, **kwargs):
+        if not use_cache:
+            return func(*args, **kwargs)
+
+        folder = cache_dir or CACHE_DIR
+        limit = max_bytes or CACHE_MAX_BYTES
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key_str = repr(
+            [func.__module__, func.__qualname__, function_fingerprint]
+            + [(k, _fingerprint_argument(v)) for k, v in bound.arguments.items()]
+        )
+        key = hashlib.sha256(key_str.encode()).hexdigest()
+        path = f"{folder}{func.__name__}_{key}.pkl"
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            # touching the file to mark it as recently used
+            os.utime(path)
+            logging.debug(f"{func.__name__} result is loaded from cache at {path}")
+            return result
+
+        result = func(*args, **kwargs)
+
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        logging.debug(f"{func.__name__} result is saved to cache at {path}")
+        _evict(folder, limit)
+
+        return result
+
+    return wrapper
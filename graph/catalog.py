@@ -0,0 +1,331 @@
+import hashlib
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .plot_helpers import get_run_fingerprint, load_run_summary
+
+
+logging.basicConfig(
+    filename="logs/graph.log",
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+    force=True,
+)
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_folder TEXT PRIMARY KEY,
+    name TEXT,
+    shock_distribution TEXT,
+    alpha REAL,
+    scale_param REAL,
+    default_threshold REAL,
+    no_of_iterations INTEGER,
+    runtime REAL,
+    results_path TEXT,
+    fingerprint TEXT,
+    model TEXT,
+    beta REAL,
+    accelerate INTEGER
+);
+CREATE TABLE IF NOT EXISTS sector_effects (
+    run_folder TEXT NOT NULL REFERENCES runs(run_folder) ON DELETE CASCADE,
+    shocked_sector TEXT NOT NULL,
+    target_sector TEXT NOT NULL,
+    mean_total REAL,
+    median_total REAL,
+    p95_total REAL,
+    mean_direct REAL,
+    PRIMARY KEY (run_folder, shocked_sector, target_sector)
+);
+CREATE TABLE IF NOT EXISTS scenario_effects (
+    run_folder TEXT NOT NULL REFERENCES runs(run_folder) ON DELETE CASCADE,
+    scenario TEXT NOT NULL,
+    sector TEXT NOT NULL,
+    shocked INTEGER,
+    mean_defaults REAL,
+    default_ratio REAL,
+    mean_contagion_defaults REAL,
+    mean_equity_loss REAL,
+    p95_equity_loss REAL,
+    PRIMARY KEY (run_folder, scenario, sector)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_parameters
+    ON runs (alpha, scale_param, default_threshold);
+CREATE INDEX IF NOT EXISTS idx_sector_effects_pair
+    ON sector_effects (shocked_sector, target_sector, mean_total);
+"""
+
+# columns added to the runs table after the first version of the catalog
+MODEL_COLUMNS = {"model": "TEXT", "beta": "REAL", "accelerate": "INTEGER"}
+RUN_FILTERS = [
+    "alpha",
+    "scale_param",
+    "default_threshold",
+    "no_of_iterations",
+    *MODEL_COLUMNS,
+]
+
+
+def connect_catalog(catalog_path):
+    """
+    Helper function that opens the catalog database and creates its tables. The
+    model columns are added to the runs of an older catalog and those runs are
+    reindexed at their next registration.
+    """
+
+    folder = os.path.dirname(catalog_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    con = sqlite3.connect(catalog_path)
+    con.execute("PRAGMA foreign_keys = ON")
+    con.executescript(CATALOG_SCHEMA)
+
+    columns = {row[1] for row in con.execute("PRAGMA table_info(runs)")}
+    missing = [column for column in MODEL_COLUMNS if column not in columns]
+    if missing:
+        with con:
+            for column in missing:
+                con.execute(
+                    f"ALTER TABLE runs ADD COLUMN {column} {MODEL_COLUMNS[column]}"
+                )
+            con.execute("UPDATE runs SET fingerprint = NULL")
+
+    return con
+
+
+def read_run_metadata(run_path):
+    """
+    Helper function that reads the metadata file of a run into a dictionary with
+    the numeric parameters converted to numbers. Runs without a model in their
+    metadata used the default cascade, beta and accelerate are only set for the
+    fractional model.
+    """
+
+    metadata = pd.read_csv(f"{run_path}/metadata.csv", header=None, index_col=0)[1]
+    metadata = metadata.to_dict()
+
+    for key in ["alpha", "scale_param", "default_threshold", "time elapsed"]:
+        if key in metadata:
+            metadata[key] = float(metadata[key])
+    metadata["no_of_iterations"] = int(float(metadata["no_of_iterations"]))
+    metadata["model"] = metadata.get("model", "default")
+    if "beta" in metadata:
+        metadata["beta"] = float(metadata["beta"])
+    if "accelerate" in metadata:
+        metadata["accelerate"] = int(str(metadata["accelerate"]) == "True")
+
+    return metadata
+
+
+def register_run(catalog_path, simulations_path, run_folder, sector_list, name=None):
+    """
+    Function that adds a run to the catalog with its parameters from the metadata
+    file and the aggregated effect of every shocked sector on every target
+    sector. A run that is already in the catalog is only reindexed if its
+    contents have changed.
+    """
+
+    run_path = f"{simulations_path}/{run_folder}"
+    fingerprint = get_run_fingerprint(run_path, sector_list)
+
+    con = connect_catalog(catalog_path)
+    try:
+        row = con.execute(
+            "SELECT fingerprint, name FROM runs WHERE run_folder = ?", (run_folder,)
+        ).fetchone()
+        if row is not None and row[0] == fingerprint:
+            if name is not None and row[1] != name:
+                with con:
+                    con.execute(
+                        "UPDATE runs SET name = ? WHERE run_folder = ?",
+                        (name, run_folder),
+                    )
+            return 0
+
+        metadata = read_run_metadata(run_path)
+        summary = load_run_summary(simulations_path, run_folder, sector_list)
+
+        effect_rows = []
+        for shocked_sector, fields in summary.items():
+            mean_total = fields["total"].mean(axis=0)
+            median_total = np.median(fields["total"], axis=0)
+            p95_total = np.percentile(fields["total"], 95, axis=0)
+            mean_direct = fields["direct"].mean(axis=0)
+            for i, target_sector in enumerate(fields["sectors"]):
+                effect_rows.append(
+                    (
+                        run_folder,
+                        shocked_sector.strip(),
+                        str(target_sector).strip(),
+                        float(mean_total[i]),
+                        float(median_total[i]),
+                        float(p95_total[i]),
+                        float(mean_direct[i]),
+                    )
+                )
+
+        with con:
+            con.execute("DELETE FROM runs WHERE run_folder = ?", (run_folder,))
+            con.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_folder,
+                    name,
+                    metadata.get("shock_distribution"),
+                    metadata.get("alpha"),
+                    metadata.get("scale_param"),
+                    metadata["default_threshold"],
+                    metadata["no_of_iterations"],
+                    metadata["time elapsed"],
+                    metadata.get("results_path"),
+                    fingerprint,
+                    metadata["model"],
+                    metadata.get("beta"),
+                    metadata.get("accelerate"),
+                ),
+            )
+            con.executemany(
+                "INSERT INTO sector_effects VALUES (?, ?, ?, ?, ?, ?, ?)", effect_rows
+            )
+        logging.info(f"run {run_folder} is registered in the catalog at {catalog_path}")
+    finally:
+        con.close()
+
+    return 1
+
+
+def register_scenario_run(catalog_path, scenarios_path, run_folder, name=None):
+    """
+    Function that adds a scenario run of simulate_scenarios to the catalog with
+    its parameters from the metadata file and the summary of every scenario by
+    sector. The shock parameters differ between the scenarios, they are found
+    in the scenarios.yaml of the run. A run that is already in the catalog is
+    only reindexed if its contents have changed.
+    """
+
+    run_path = f"{scenarios_path}/{run_folder}"
+    h = hashlib.sha256()
+    for file in ["metadata.csv", "scenario_summary.csv"]:
+        stat = os.stat(f"{run_path}/{file}")
+        h.update(repr((file, stat.st_size, stat.st_mtime_ns)).encode())
+    fingerprint = h.hexdigest()
+
+    con = connect_catalog(catalog_path)
+    try:
+        row = con.execute(
+            "SELECT fingerprint FROM runs WHERE run_folder = ?", (run_folder,)
+        ).fetchone()
+        if row is not None and row[0] == fingerprint:
+            return 0
+
+        metadata = read_run_metadata(run_path)
+        summary = pd.read_csv(f"{run_path}/scenario_summary.csv")
+        summary["sector"] = summary["sector"].str.strip()
+        summary["shocked"] = summary["shocked"].astype(int)
+        summary.insert(0, "run_folder", run_folder)
+
+        with con:
+            con.execute("DELETE FROM runs WHERE run_folder = ?", (run_folder,))
+            con.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_folder,
+                    name,
+                    metadata.get("shock_distribution"),
+                    None,
+                    None,
+                    metadata["default_threshold"],
+                    metadata["no_of_iterations"],
+                    metadata["time elapsed"],
+                    metadata.get("results_path"),
+                    fingerprint,
+                    metadata["model"],
+                    metadata.get("beta"),
+                    metadata.get("accelerate"),
+                ),
+            )
+            con.executemany(
+                "INSERT INTO scenario_effects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                summary.itertuples(index=False, name=None),
+            )
+        logging.info(
+            f"scenario run {run_folder} is registered in the catalog at {catalog_path}"
+        )
+    finally:
+        con.close()
+
+    return 1
+
+
+def update_catalog(catalog_path, simulations_path, sector_list, output_map=None):
+    """
+    Function that registers every finished run of the simulations folder (the
+    ones with a metadata file) in the catalog. The names of the runs are taken
+    from the output map (name: run folder) where available.
+    """
+
+    names = {}
+    if output_map is not None:
+        names = {folder: name for name, folder in output_map.items()}
+
+    updated = 0
+    for run_folder in sorted(os.listdir(simulations_path)):
+        if os.path.exists(f"{simulations_path}/{run_folder}/metadata.csv"):
+            updated += register_run(
+                catalog_path,
+                simulations_path,
+                run_folder,
+                sector_list,
+                names.get(run_folder),
+            )
+    logging.info(f"{updated} runs are (re)indexed in the catalog")
+
+    return updated
+
+
+def query_catalog(catalog_path, sql, params=()):
+    """Function that runs a query on the catalog and returns the result as a dataframe."""
+
+    con = connect_catalog(catalog_path)
+    try:
+        ret_df = pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
+
+    return ret_df
+
+
+def find_runs_by_effect(
+    catalog_path, shocked_sector, target_sector, min_effect, **parameters
+):
+    """
+    Function that returns the runs where the shocks on shocked_sector default
+    more than min_effect percent of target_sector on average. The runs can be
+    filtered further by their parameters, e.g. alpha=0.7, or by the propagation
+    model, e.g. model="fractional", beta=0.5, accelerate=False.
+
+    Example: find_runs_by_effect(path, "Energy", "Utilities", 5, alpha=0.7)
+    """
+
+    conditions = ["e.shocked_sector = ?", "e.target_sector = ?", "e.mean_total > ?"]
+    params = [shocked_sector.strip(), target_sector.strip(), min_effect]
+    for key, value in parameters.items():
+        if key not in RUN_FILTERS:
+            raise ValueError(f"unknown run parameter: {key}")
+        conditions.append(f"r.{key} = ?")
+        params.append(value)
+
+    sql = (
+        "SELECT r.*, e.shocked_sector, e.target_sector, e.mean_total, "
+        "e.median_total, e.p95_total, e.mean_direct "
+        "FROM sector_effects e JOIN runs r ON r.run_folder = e.run_folder "
+        f"WHERE {' AND '.join(conditions)} ORDER BY e.mean_total DESC"
+    )
+
+    return query_catalog(catalog_path, sql, params)
@@ -1,6 +1,5 @@
 import networkx as nx
-import pandas as pd
-from load.manipulations import update_values_in_edgelist
+from load.helpers import read_file
 import logging
 from tqdm import tqdm
 
@@ -12,7 +11,7 @@ logging.basicConfig(
 )
 
 
-def create_original_graph(edgelist_path, node_path, wrong_nodes):
+def create_original_graph(edgelist_path, node_path):
     """
     Function that takes the nodes info and edgelist as input and returns a graph
     with attributes set to the edges (value) and to the nodes (sector, assets)
@@ -20,9 +19,8 @@ def create_original_graph(edgelist_path, node_path, wrong_nodes):
     liabilities, equity). For financial companies the asset value is the sum of the
     """
 
-    edgelist = pd.read_csv(edgelist_path)
-    node_info = pd.read_csv(node_path)
-    edgelist = update_values_in_edgelist(edgelist, wrong_nodes)
+    edgelist = read_file(edgelist_path)
+    node_info = read_file(node_path)
 
     edgelist, node_info = remove_financials_not_in_source(edgelist, node_info)
 
@@ -1,11 +1,14 @@
 import pandas as pd
 import networkx as nx
 import numpy as np
+from itertools import chain, repeat
+from scipy import sparse
 import logging
 
+from .cache import memoize_analysis
 from .plot_helpers import (
-    calculate_effect_from_other_sectors,
-    load_simulation_for_all_sectors,
+    calculate_effect_from_run_summary,
+    load_run_summary,
     sort_dictionary_by_mean_of_list,
 )
 
@@ -18,6 +21,7 @@ logging.basicConfig(
 )
 
 
+@memoize_analysis
 def create_descriptive_table(graphs: list):
     """
     Function to create a descriptive analysis on both graphs.Node count, edge count,
@@ -63,6 +67,7 @@ def create_descriptive_table(graphs: list):
     return ret_df
 
 
+@memoize_analysis
 def analyze_sectors(g, sectors, cc_weight="Arithm"):
     """
      Return the nodes, absolute and relative size, clustering coefficient and
@@ -170,18 +175,17 @@ def create_largest_influence_table(output_map, simulations_path, sector_list):
     """
     Function that returns a dataframe where the columns represent different
     simulations and the indices represent sectors, while the values are the
-    most influential sectors for each sector in terms of defaults.
+    most influential sectors for each sector in terms of defaults. Only the
+    summaries of the runs are read, they are created on first access.
     """
 
     master_dict = {}
     # iterating through every simulation
     for sim, folder in output_map.items():
-        sectors_dict = load_simulation_for_all_sectors(
-            simulations_path, folder, sector_list
-        )
+        summary = load_run_summary(simulations_path, folder, sector_list)
 
         # calculating effects from other sectors
-        result_dict = calculate_effect_from_other_sectors(sectors_dict)
+        result_dict = calculate_effect_from_run_summary(summary)
 
         # getting the largest influential sector (value) for every sector (keys)
         largest_impact_dict = {}
@@ -195,39 +199,117 @@ def create_largest_influence_table(output_map, simulations_path, sector_list):
     return ret_df
 
 
-def create_sector_overview_graph(g, sector_df, path, method, ret=False):
+def get_adjacency_csr(g, nodelist=None, weight="weight"):
     """
-    Function that creates a graph from all sectors where the edges are calculated
-    based on the given method (sum or mean). The function writes the network to
-    a file to represent it with other softwares.
+    Helper function that returns the weighted adjacency matrix of the graph in
+    CSR format. For undirected graphs every edge is stored in both directions.
+    """
+
+    if nodelist is None:
+        nodelist = list(g.nodes())
+    index = {n: i for i, n in enumerate(nodelist)}
+
+    # the adjacency dict of an undirected graph holds every edge in both
+    # directions, so the rows of the nodes give the symmetric matrix
+    neighbors = [g.adj[u] for u in nodelist]
+    degrees = np.fromiter(map(len, neighbors), dtype=int, count=len(nodelist))
+    m = degrees.sum()
+    row = np.repeat(np.arange(len(nodelist)), degrees)
+    col = np.fromiter(
+        chain.from_iterable(map(index.get, nbrs, repeat(-1)) for nbrs in neighbors),
+        dtype=int,
+        count=m,
+    )
+    data = np.fromiter(
+        (d.get(weight, 1) for nbrs in neighbors for d in nbrs.values()),
+        dtype=float,
+        count=m,
+    )
+
+    # edges to nodes outside the nodelist are dropped
+    mask = col >= 0
+    row, col, data = row[mask], col[mask], data[mask]
+
+    n = len(nodelist)
+    return sparse.csr_matrix(
+        (data.astype(float), (row.astype(int), col.astype(int))), shape=(n, n)
+    )
+
+
+def get_sector_codes(g, sector_list, nodelist=None):
+    """
+    Helper function that returns the integer code of every node's sector based
+    on its position in sector_list. Nodes outside the list get -1.
     """
 
-    edges = nx.get_edge_attributes(g, "weight")
-    nodes = list(edges.keys())
+    if nodelist is None:
+        nodelist = list(g.nodes())
+    sectors = [g.nodes[n].get("sector") for n in nodelist]
 
-    edge_df = pd.DataFrame(nodes, columns=["source", "target"])
-    edge_df["tuples"] = nodes
+    return pd.Categorical(sectors, categories=list(sector_list)).codes.astype(int)
 
-    edge_df["weight"] = edge_df["tuples"].map(edges)
 
-    nodes_with_attr = nx.get_node_attributes(g, "sector")
-    edge_df["source_sector"] = edge_df["source"].map(nodes_with_attr)
-    edge_df["target_sector"] = edge_df["target"].map(nodes_with_attr)
+def calculate_sector_weight_matrix(g, sector_list, method="sum"):
+    """
+    Function that aggregates the edge weights of the graph to a sector x sector
+    matrix, where the rows and columns follow the order of sector_list. With the
+    sum method the weights of every edge between two sectors are summarized, with
+    the average method the sum is divided by the number of these edges. The
+    diagonal holds the values for the edges within a sector.
+    """
 
-    if method == "average":
-        el = edge_df.groupby(["source_sector", "target_sector"]).mean().reset_index()
+    nodelist = list(g.nodes())
+    adj = get_adjacency_csr(g, nodelist).tocoo()
+    codes = get_sector_codes(g, sector_list, nodelist)
+    k = len(sector_list)
+
+    row_codes = codes[adj.row]
+    col_codes = codes[adj.col]
+    mask = (row_codes >= 0) & (col_codes >= 0)
+    pair_codes = row_codes[mask] * k + col_codes[mask]
+
+    weight_m = np.bincount(pair_codes, weights=adj.data[mask], minlength=k * k)
+    count_m = np.bincount(pair_codes, minlength=k * k).astype(float)
+    weight_m = weight_m.reshape(k, k)
+    count_m = count_m.reshape(k, k)
+
+    # edges within a sector are stored in both directions in the adjacency matrix
+    if not g.is_directed():
+        np.fill_diagonal(weight_m, np.diag(weight_m) / 2)
+        np.fill_diagonal(count_m, np.diag(count_m) / 2)
+
+    if method == "sum":
+        return weight_m
+    elif method == "average":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_m = np.where(count_m > 0, weight_m / count_m, 0)
+        return avg_m
+    else:
+        raise ValueError(f"unknown aggregation method: {method}")
 
-    elif method == "sum":
-        el = edge_df.groupby(["source_sector", "target_sector"]).sum().reset_index()
 
-    sector_graph = nx.from_pandas_edgelist(
-        el,
-        source="source_sector",
-        target="target_sector",
-        edge_attr="weight",
-        create_using=nx.Graph,
+def create_sector_overview_graph(
+    g, sector_df, path, method, ret=False, sector_list=None, to_file=True
+):
+    """
+    Function that creates a graph from all sectors where the edges are calculated
+    based on the given method (sum or average). The function writes the network to
+    a file to represent it with other softwares. If ret is true, the sector graph
+    is returned, the sector x sector weight matrix itself is returned by
+    calculate_sector_weight_matrix.
+    """
+
+    if sector_list is None:
+        sector_list = list(sector_df["sector"])
+
+    weight_m = calculate_sector_weight_matrix(g, sector_list, method)
+
+    sector_graph = nx.Graph()
+    sector_graph.add_nodes_from(sector_list)
+    rows, cols = np.nonzero(np.triu(weight_m, k=1))
+    sector_graph.add_weighted_edges_from(
+        (sector_list[i], sector_list[j], weight_m[i, j]) for i, j in zip(rows, cols)
     )
-    sector_graph.remove_edges_from(nx.selfloop_edges(sector_graph))
 
     node_info = sector_df[["sector", "total_sector_size"]].set_index("sector")
     node_info = node_info.to_dict(orient="index")
@@ -235,10 +317,12 @@ def create_sector_overview_graph(g, sector_df, path, method, ret=False):
         sector_graph,
         node_info,
     )
-    if method == "average":
-        nx.write_gexf(sector_graph, f"{path}sectors_avg.gexf")
-    elif method == "sum":
-        nx.write_gexf(sector_graph, f"{path}sectors_sum.gexf")
+
+    if to_file:
+        if method == "average":
+            nx.write_gexf(sector_graph, f"{path}sectors_avg.gexf")
+        elif method == "sum":
+            nx.write_gexf(sector_graph, f"{path}sectors_sum.gexf")
 
     if ret:
         return sector_graph
@@ -246,6 +330,7 @@ def create_sector_overview_graph(g, sector_df, path, method, ret=False):
         return 1
 
 
+@memoize_analysis
 def calculate_weighted_degree_for_sectors(sector_graph):
 
     df = pd.DataFrame(
@@ -5,13 +5,19 @@ from typing import Union
 import logging
 import os
 import csv
+import yaml
 from multiprocessing import Pool, cpu_count
 from functools import partial
 from datetime import datetime
+from itertools import combinations
 from time import time
+from scipy import sparse
+from scipy.sparse.linalg import bicgstab
+from scipy.special import ndtr
 
 
-from .describe import get_sector_nodes
+from .catalog import register_run, register_scenario_run
+from .describe import get_adjacency_csr, get_sector_nodes
 
 
 logging.basicConfig(
@@ -21,6 +27,10 @@ logging.basicConfig(
     force=True,
 )
 
+LOSS_TOLERANCE = 1e-9
+MAX_PROPAGATION_ROUNDS = 1000
+SIMULATION_BATCH_SIZE = 500
+
 
 def propagate_default(g, default_threshold):
     """
@@ -73,6 +83,177 @@ def propagate_default(g, default_threshold):
     return g
 
 
+def propagate_default_arrays(
+    adj, assets, equity, equity_orig, default_round, default_threshold
+):
+    """
+    Function that does the same as propagate_default on arrays: adj is the
+    weighted adjacency matrix in CSR format, the other arguments are arrays in
+    the node order of adj, default_round is 0 for the nodes that did not
+    default. The defaulters of a round are processed in node order like in
+    propagate_default, so the results are the same. The arrays are updated in
+    place and returned.
+    """
+
+    indptr, indices, weights = adj.indptr, adj.indices, adj.data
+    default_limit = equity_orig * default_threshold
+
+    round = 1
+    default = np.flatnonzero(default_round == round)
+    while len(default):
+        round += 1
+        for n in default:
+            neighbors = indices[indptr[n] : indptr[n + 1]]
+            alive = default_round[neighbors] == 0
+            neighbors = neighbors[alive]
+            neighbor_weights = weights[indptr[n] : indptr[n + 1]][alive]
+
+            weight_sum = neighbor_weights.sum()
+            if weight_sum == 0:
+                continue
+
+            loss = equity_orig[n] * neighbor_weights / weight_sum
+            assets[neighbors] -= loss
+            equity[neighbors] -= loss
+            new_defaulters = neighbors[equity[neighbors] < default_limit[neighbors]]
+            default_round[new_defaulters] = round
+
+        default = np.flatnonzero(default_round == round)
+
+    return assets, equity, default_round
+
+
+def create_propagation_arrays(g):
+    """
+    Function that collects the data of the fractional loss propagation from the
+    graph: the node attributes in node order, the asset, liability and equity
+    values as arrays and the transposed row-normalized weight matrix, where the
+    element (j, i) is the share of node i's loss that is passed on to node j.
+    """
+
+    nodes = list(g.nodes())
+    adj = get_adjacency_csr(g, nodes)
+    weight_sum = np.asarray(adj.sum(axis=1)).ravel()
+    inverse = np.divide(
+        1.0, weight_sum, out=np.zeros_like(weight_sum), where=weight_sum > 0
+    )
+    attributes = pd.DataFrame.from_dict(dict(g.nodes(data=True)), orient="index")
+    attributes = attributes.reset_index(drop=True)
+
+    return {
+        "nodes": nodes,
+        "attributes": attributes,
+        "assets": attributes["assets"].to_numpy(dtype=float),
+        "liabilities": attributes["liabilities"].to_numpy(dtype=float),
+        "equity": attributes["equity"].to_numpy(dtype=float),
+        "adjacency": adj,
+        "transfer": (sparse.diags(inverse) @ adj).T.tocsr(),
+    }
+
+
+def solve_losses(transfer, initial_loss, equity, beta, tol=LOSS_TOLERANCE):
+    """
+    Helper function that finds the fixed point L = min(E, L0 + beta * P^T L) of
+    one draw with the fictitious default algorithm of Eisenberg and Noe. It
+    starts with every loss capped at the equity, then the nodes whose loss
+    falls below their equity are released and their losses are solved from the
+    sparse linear system (I - beta * P^T_FF) L_F = L0_F + beta * P^T_FC E_C,
+    until no node is released. The system is solved with BiCGSTAB, as the hubs
+    of the graph make a direct factorization fill in. Returns the capped losses.
+    """
+
+    is_capped = np.ones(len(equity), dtype=bool)
+    losses = equity.copy()
+    while True:
+        total = initial_loss + beta * (transfer @ losses)
+        released = is_capped & (total < equity)
+        if not released.any():
+            return losses
+
+        is_capped &= ~released
+        free = np.flatnonzero(~is_capped)
+        capped_loss = np.where(is_capped, equity, 0.0)
+        system = sparse.identity(len(free), format="csr") - beta * (
+            transfer[free][:, free]
+        )
+        rhs = initial_loss[free] + beta * (transfer @ capped_loss)[free]
+        x0 = np.minimum(total[free], equity[free])
+        try:
+            solution, info = bicgstab(system, rhs, x0=x0, rtol=tol, atol=0.0)
+        except TypeError:
+            # scipy before 1.12 calls the relative tolerance tol
+            solution, info = bicgstab(system, rhs, x0=x0, tol=tol, atol=0.0)
+        if info > 0:
+            logging.warning(f"linear solve of the losses did not converge: {info}")
+
+        losses = capped_loss
+        losses[free] = solution
+
+
+def propagate_losses(
+    transfer,
+    initial_loss,
+    equity,
+    beta,
+    default_threshold,
+    tol=LOSS_TOLERANCE,
+    max_rounds=MAX_PROPAGATION_ROUNDS,
+    accelerate=False,
+):
+    """
+    Function that propagates the losses of a batch of shocks (one column for
+    every draw) fractionally: every node passes beta share of its loss, capped at
+    its equity, to its neighbors in proportion to the edge weights, whether it
+    defaulted or not. The fixed point L = min(E, L0 + beta * P^T L) is found
+    with an iteration that stops when no loss changes more than tol times the
+    node's equity. With accelerate the fixed point is solved for every draw
+    with solve_losses and the iteration only runs until every defaulter is
+    reached, which pays off when the iteration needs many rounds to converge
+    (beta close to 1 with few losses reaching the equity). Returns the total
+    (uncapped) loss of the nodes and the round in which they defaulted, 0 if
+    they did not.
+    """
+
+    equity = equity[:, None]
+    default_loss = equity * (1 - default_threshold)
+
+    if accelerate:
+        solution = np.column_stack(
+            [
+                solve_losses(transfer, initial_loss[:, d], equity[:, 0], beta, tol)
+                for d in range(initial_loss.shape[1])
+            ]
+        )
+        final_loss = initial_loss + beta * (transfer @ solution)
+        defaulters = final_loss > default_loss
+
+    loss = initial_loss
+    capped = np.minimum(loss, equity)
+    default_round = np.where(loss > default_loss, 1, 0)
+
+    for round in range(2, max_rounds + 2):
+        if accelerate and not (defaulters & (default_round == 0)).any():
+            break
+
+        loss = initial_loss + beta * (transfer @ capped)
+        new_capped = np.minimum(loss, equity)
+        default_round[(default_round == 0) & (loss > default_loss)] = round
+
+        converged = (np.abs(new_capped - capped) <= tol * np.abs(equity)).all()
+        capped = new_capped
+        if converged and not accelerate:
+            break
+    else:
+        logging.warning(f"loss propagation did not converge in {max_rounds} rounds")
+
+    if accelerate:
+        # nodes that would only cross the threshold after max_rounds
+        default_round[defaulters & (default_round == 0)] = max_rounds + 1
+        return final_loss, default_round
+
+    return loss, default_round
+
+
 def generate_shock_from_pareto(
     g: nx.Graph,
     node_list: Union[list, str],
@@ -103,6 +284,139 @@ def generate_shock_from_pareto(
     return g
 
 
+def get_sector_mask(node_sectors: np.ndarray, sectors: list):
+    """
+    Helper function that returns the mask of the nodes in the given sectors.
+    The sector names are compared without the surrounding whitespace, as the
+    sector labels of the graph can have trailing spaces that the names in the
+    config do not have. Raises ValueError for a sector that has no nodes.
+    """
+
+    codes, uniques = pd.factorize(node_sectors)
+    labels = pd.Index([str(label).strip() for label in uniques])
+    selected = labels.get_indexer([str(sector).strip() for sector in sectors])
+    for sector, i in zip(sectors, selected):
+        if i < 0:
+            raise ValueError(f"unknown sector: {sector}")
+
+    return np.isin(codes, selected)
+
+
+def generate_joint_shocks_from_pareto(
+    node_sectors: np.ndarray,
+    sectors: list,
+    alpha: float,
+    scale: float,
+    draws: int,
+    market_correlation: float = 0.0,
+    sector_correlation: float = 0.0,
+    rng: np.random.Generator = None,
+):
+    """
+    Function that generates shocks on the nodes of several sectors at once. The
+    shocks have the same pareto distribution as in generate_shock_from_pareto,
+    their dependence is set by a gaussian factor copula: the latent variable of
+    a node is sqrt(m) * M + sqrt(s) * S + sqrt(1 - m - s) * e, where M is the
+    common market factor, S the factor of the node's sector and e its own noise.
+    The latent variables are turned to shocks with the inverse CDF of the
+    pareto distribution. Returns the (draws x nodes) array of shocks, 0 for the
+    nodes outside the sectors. Raises ValueError for an unknown sector.
+    """
+
+    if market_correlation < 0 or sector_correlation < 0:
+        raise ValueError("correlations must not be negative")
+    if market_correlation + sector_correlation > 1:
+        raise ValueError("market and sector correlation must not add up over 1")
+    if rng is None:
+        rng = np.random.default_rng()
+
+    shocked = np.flatnonzero(get_sector_mask(node_sectors, sectors))
+    codes, uniques = pd.factorize(node_sectors[shocked])
+
+    latent = np.sqrt(market_correlation) * rng.standard_normal((draws, 1))
+    latent = (
+        latent
+        + np.sqrt(sector_correlation)
+        * rng.standard_normal((draws, len(uniques)))[:, codes]
+    )
+    latent += np.sqrt(1 - market_correlation - sector_correlation) * (
+        rng.standard_normal((draws, len(shocked)))
+    )
+
+    # inverse CDF of the pareto distribution with minimum 1 on the upper tail
+    shocks = np.zeros((draws, len(node_sectors)))
+    shocks[:, shocked] = ndtr(-latent) ** (-1 / alpha) * scale
+
+    return shocks
+
+
+def propagate_shock_batch(
+    arrays: dict,
+    asset_losses: np.ndarray,
+    default_threshold: float,
+    model: str = "default",
+    beta: float = 0.5,
+):
+    """
+    Function that propagates a batch of shocks given as the (draws x nodes)
+    array of the share of assets lost by every node, with the default cascade
+    (propagate_default_arrays, one draw after the other) or the fractional
+    model (propagate_losses, every draw at once). Returns the equity and the
+    default round (0 if the node did not default) of the nodes in every draw.
+    """
+
+    if model not in ["default", "fractional"]:
+        raise ValueError(f"unknown propagation model: {model}")
+
+    assets = arrays["assets"]
+    equity_orig = arrays["equity"]
+
+    # the shocked nodes lose from their assets, the loss is measured on equity
+    shocked_assets = assets * (1 - asset_losses)
+    shocked_equity = shocked_assets - arrays["liabilities"]
+
+    if model == "fractional":
+        initial_loss = (equity_orig - shocked_equity) * (asset_losses > 0)
+        loss, default_round = propagate_losses(
+            arrays["transfer"], initial_loss.T, equity_orig, beta, default_threshold
+        )
+        return equity_orig - loss.T, default_round.T
+
+    equity = np.where(asset_losses > 0, shocked_equity, equity_orig)
+    default_round = np.where(equity < equity_orig * default_threshold, 1, 0)
+    for d in range(len(asset_losses)):
+        propagate_default_arrays(
+            arrays["adjacency"],
+            np.where(asset_losses[d] > 0, shocked_assets[d], assets),
+            equity[d],
+            equity_orig,
+            default_round[d],
+            default_threshold,
+        )
+
+    return equity, default_round
+
+
+def aggregate_by_sector(default_round, equity_loss, sector_codes, sector_count):
+    """
+    Helper function that sums the number of defaulted nodes and the lost equity
+    by sector in every draw. Returns two (draws x sectors) arrays.
+    """
+
+    indicator = sparse.csr_matrix(
+        (
+            np.ones(len(sector_codes)),
+            (np.arange(len(sector_codes)), sector_codes),
+        ),
+        shape=(len(sector_codes), sector_count),
+    )
+
+    defaults = (indicator.T @ (default_round > 0).T.astype(float)).T
+    losses = (indicator.T @ equity_loss.T).T
+
+    return defaults, losses
+
+
 def simulate_one_shock_from_pareto(
     g: nx.Graph,
     node_list: str,
@@ -139,6 +453,23 @@ def save_graph_to_feather(g, path, iteration):
     df.to_feather(f"{path}/{iteration}.feather", compression="zstd")
 
 
+def save_realization_to_feather(arrays, assets, equity, default_round, path, iteration):
+    """
+    Helper function that saves one realization given as arrays in the same
+    format as save_graph_to_feather: the node attributes with the updated asset
+    and equity values, the default round (missing if the node did not default)
+    and the original equity.
+    """
+
+    df = arrays["attributes"].copy()
+    df["assets"] = assets
+    df["equity"] = equity
+    df["default_round"] = np.where(default_round > 0, default_round, np.nan)
+    df["equity_orig"] = arrays["equity"]
+
+    df.to_feather(f"{path}/{iteration}.feather", compression="zstd")
+
+
 def simulate_shocks_from_pareto(
     g: nx.Graph,
     sector: str,
@@ -172,6 +503,109 @@ def simulate_shocks_from_pareto(
     return 1
 
 
+def simulate_fractional_shock_batch(
+    arrays: dict,
+    node_list: list,
+    alpha: float,
+    scale: float,
+    default_threshold: float,
+    beta: float,
+    accelerate: bool,
+    sector_path: str,
+    batch: tuple,
+):
+    """
+    Function that generates a batch of shocks from pareto distribution for the
+    given set of nodes, propagates them with the fractional model and saves every
+    draw to the given folder in the same format as the default cascade model.
+    """
+
+    start, size = batch
+    shocked = np.flatnonzero(pd.Index(arrays["nodes"]).isin(node_list))
+    assets = arrays["assets"]
+
+    np.random.seed()
+    shock_list = (np.random.pareto(alpha, (len(shocked), size)) + 1) * scale
+
+    # the shocked nodes lose from their assets, the loss is measured on equity
+    asset_loss = np.zeros((len(assets), size))
+    asset_loss[shocked] = assets[shocked, None] * (1 - np.exp(-shock_list))
+    initial_loss = np.zeros((len(assets), size))
+    initial_loss[shocked] = arrays["equity"][shocked, None] - (
+        assets[shocked, None]
+        - asset_loss[shocked]
+        - arrays["liabilities"][shocked, None]
+    )
+
+    loss, default_round = propagate_losses(
+        arrays["transfer"],
+        initial_loss,
+        arrays["equity"],
+        beta,
+        default_threshold,
+        accelerate=accelerate,
+    )
+
+    for d in range(size):
+        save_realization_to_feather(
+            arrays,
+            assets - asset_loss[:, d] - (loss[:, d] - initial_loss[:, d]),
+            arrays["equity"] - loss[:, d],
+            default_round[:, d],
+            sector_path,
+            start + d + 1,
+        )
+
+    return 1
+
+
+def simulate_fractional_shocks_from_pareto(
+    g: nx.Graph,
+    sector: str,
+    alpha: float,
+    scale: float,
+    default_threshold: float,
+    repeat: int,
+    sector_path: str,
+    beta: float,
+    accelerate: bool = False,
+    arrays: dict = None,
+):
+    """
+    Main function that generates shocks for one sector and propagates them with
+    the fractional loss model. The draws are split into batches that are solved
+    together with sparse matrix products, the batches run in parallel. The
+    arrays of the graph can be given to avoid building them for every sector.
+    """
+
+    if arrays is None:
+        arrays = create_propagation_arrays(g)
+    node_list = get_sector_nodes(g, sector)
+
+    cpu = cpu_count()
+    batch_size = max(1, min(SIMULATION_BATCH_SIZE, -(-repeat // cpu)))
+    batches = [
+        (start, min(batch_size, repeat - start))
+        for start in range(0, repeat, batch_size)
+    ]
+
+    func = partial(
+        simulate_fractional_shock_batch,
+        arrays,
+        node_list,
+        alpha,
+        scale,
+        default_threshold,
+        beta,
+        accelerate,
+        sector_path,
+    )
+    with Pool(min(cpu, len(batches))) as pool:
+        pool.map(func, batches)
+
+    return 1
+
+
 def simulate_shock_for_multiple_sectors(
     g: nx.Graph,
     alpha: float,
@@ -180,16 +614,26 @@ def simulate_shock_for_multiple_sectors(
     repeat: int,
     simulation_path: str,
     sectors_list: str,
+    catalog_path: str = None,
+    model: str = "default",
+    beta: float = 0.5,
+    accelerate: bool = False,
 ):
     """
     Main function that runs the monte carlo simulation for multiple given sectors.
     For each simulation a new folder is created with the actual date and within them
     each sector have their own folder. The metadata about the run (shock parameters,
     default threshold, number of iterations, path, etc.) are also saved to a
-    metadata file.
+    metadata file. If catalog_path is given, the finished run is registered in
+    the results catalog.
+    The model is either "default" (only defaulted nodes pass on their equity) or
+    "fractional" (every node passes beta share of its loss to its neighbors).
     This is the version that runs multiprocessing among the iteration dimension.
     """
 
+    if model not in ["default", "fractional"]:
+        raise ValueError(f"unknown propagation model: {model}")
+
     dir = datetime.now().strftime("%Y_%m_%d_%H%M%S")
     path = f"{simulation_path}{dir}"
     os.mkdir(path)
@@ -198,6 +642,8 @@ def simulate_shock_for_multiple_sectors(
     )
 
     start_time = time()
+    if model == "fractional":
+        arrays = create_propagation_arrays(g)
 
     for sector in sectors_list:
         sector_path = f"{path}/{sector}"
@@ -206,9 +652,23 @@ def simulate_shock_for_multiple_sectors(
         logging.debug(
             f"folder for {sector} sector is created in the current run folder."
         )
-        simulate_shocks_from_pareto(
-            g, sector, alpha, scale, default_threshold, repeat, sector_path
-        )
+        if model == "fractional":
+            simulate_fractional_shocks_from_pareto(
+                g,
+                sector,
+                alpha,
+                scale,
+                default_threshold,
+                repeat,
+                sector_path,
+                beta,
+                accelerate,
+                arrays,
+            )
+        else:
+            simulate_shocks_from_pareto(
+                g, sector, alpha, scale, default_threshold, repeat, sector_path
+            )
         logging.info(f"Simulation for {sector} sector is finished.")
 
     end_time = time()
@@ -223,7 +683,10 @@ def simulate_shock_for_multiple_sectors(
         "no_of_iterations": repeat,
         "results_path": path,
         "time elapsed": runtime,
+        "model": model,
     }
+    if model == "fractional":
+        metadata.update({"beta": beta, "accelerate": accelerate})
 
     metadata_df = pd.DataFrame.from_dict(metadata, orient="index")
     metadata_df.to_csv(f"{path}/metadata.csv", header=False)
@@ -231,9 +694,241 @@ def simulate_shock_for_multiple_sectors(
         f"shock simulation is finished, metadata is saved. Elapsed time: {runtime} seconds"
     )
 
+    if catalog_path is not None:
+        register_run(catalog_path, simulation_path, dir, sectors_list)
+
     return 1
 
 
+def create_sector_combination_scenarios(
+    sectors: list,
+    size: int,
+    alpha: float,
+    scale: float,
+    market_correlation: float = 0.0,
+    sector_correlation: float = 0.0,
+):
+    """
+    Function that creates a scenario library with a joint shock for every
+    combination of size sectors, all with the same shock parameters. The name
+    of a scenario is the names of its sectors joined with "+".
+    """
+
+    return {
+        "+".join(combo): {
+            "sectors": list(combo),
+            "alpha": alpha,
+            "scale": scale,
+            "market_correlation": market_correlation,
+            "sector_correlation": sector_correlation,
+        }
+        for combo in combinations(sectors, size)
+    }
+
+
+def simulate_scenario_batch(
+    arrays: dict,
+    draws: int,
+    default_threshold: float,
+    model: str,
+    beta: float,
+    path: str,
+    save_realizations: bool,
+    task: tuple,
+):
+    """
+    Function that draws the joint shocks of a batch of scenarios, propagates
+    the draws of every scenario together, at most SIMULATION_BATCH_SIZE draws
+    at a time, and summarizes the results of the scenarios by sector. With
+    save_realizations every draw is saved to the folder of its scenario.
+    """
+
+    scenarios, seed = task
+    rng = np.random.default_rng(seed)
+    node_sectors = arrays["attributes"]["sector"].to_numpy(dtype=object)
+    sector_codes, sectors = pd.factorize(node_sectors, sort=True)
+    sector_sizes = np.bincount(sector_codes, minlength=len(sectors))
+
+    total = len(scenarios) * draws
+    results = []
+    for start in range(0, total, SIMULATION_BATCH_SIZE):
+        stop = min(start + SIMULATION_BATCH_SIZE, total)
+        # the (scenario, first draw, last draw) blocks of the rows in the batch
+        blocks = [
+            (k, max(start, k * draws), min(stop, (k + 1) * draws))
+            for k in range(start // draws, (stop - 1) // draws + 1)
+        ]
+
+        shocks = np.vstack(
+            [
+                generate_joint_shocks_from_pareto(
+                    node_sectors,
+                    scenarios[k][1]["sectors"],
+                    scenarios[k][1]["alpha"],
+                    scenarios[k][1]["scale"],
+                    last - first,
+                    scenarios[k][1].get("market_correlation", 0.0),
+                    scenarios[k][1].get("sector_correlation", 0.0),
+                    rng,
+                )
+                for k, first, last in blocks
+            ]
+        )
+        asset_losses = 1 - np.exp(-shocks)
+        equity, default_round = propagate_shock_batch(
+            arrays, asset_losses, default_threshold, model, beta
+        )
+        equity_loss = arrays["equity"] - equity
+
+        defaults, losses = aggregate_by_sector(
+            default_round, equity_loss, sector_codes, len(sectors)
+        )
+        contagion, _ = aggregate_by_sector(
+            np.where(default_round > 1, default_round, 0),
+            equity_loss,
+            sector_codes,
+            len(sectors),
+        )
+        results.append((defaults, losses, contagion))
+
+        if save_realizations:
+            # the equity and the assets of a node decrease by the same amount
+            base_assets = arrays["assets"] * (1 - asset_losses)
+            base_equity = np.where(
+                asset_losses > 0,
+                base_assets - arrays["liabilities"],
+                arrays["equity"],
+            )
+            for k, first, last in blocks:
+                scenario_path = f"{path}/{scenarios[k][0]}"
+                os.makedirs(scenario_path, exist_ok=True)
+                for d in range(first, last):
+                    row = d - start
+                    save_realization_to_feather(
+                        arrays,
+                        base_assets[row] - (base_equity[row] - equity[row]),
+                        equity[row],
+                        default_round[row],
+                        scenario_path,
+                        d - k * draws + 1,
+                    )
+
+    defaults, losses, contagion = (np.vstack(parts) for parts in zip(*results))
+
+    summaries = []
+    for k, (name, scenario) in enumerate(scenarios):
+        rows = slice(k * draws, (k + 1) * draws)
+        summaries.append(
+            pd.DataFrame(
+                {
+                    "scenario": name,
+                    "sector": sectors,
+                    "shocked": get_sector_mask(sectors, scenario["sectors"]),
+                    "mean_defaults": defaults[rows].mean(axis=0),
+                    "default_ratio": defaults[rows].mean(axis=0) / sector_sizes,
+                    "mean_contagion_defaults": contagion[rows].mean(axis=0),
+                    "mean_equity_loss": losses[rows].mean(axis=0),
+                    "p95_equity_loss": np.percentile(losses[rows], 95, axis=0),
+                }
+            )
+        )
+
+    return pd.concat(summaries, ignore_index=True)
+
+
+def simulate_scenarios(
+    g: nx.Graph,
+    scenarios: dict,
+    draws: int,
+    default_threshold: float,
+    scenarios_path: str,
+    model: str = "default",
+    beta: float = 0.5,
+    save_realizations: bool = False,
+    seed: int = None,
+    catalog_path: str = None,
+):
+    """
+    Main function that evaluates a library of joint shock scenarios (name ->
+    sectors, alpha, scale, market_correlation, sector_correlation, see
+    generate_joint_shocks_from_pareto) as a batch. The scenarios are drawn and
+    propagated together in batches of at most SIMULATION_BATCH_SIZE draws that
+    run in parallel. The sectors of every scenario are checked before the run,
+    an unknown sector raises ValueError. A new folder is created with the actual date for the
+    metadata of the run, the scenario definitions and the summary of every
+    scenario by sector, which is also returned. With save_realizations every
+    draw is saved to the folder of its scenario in the same format as in
+    simulate_shock_for_multiple_sectors. If catalog_path is given, the finished
+    run is registered in the results catalog.
+    """
+
+    if model not in ["default", "fractional"]:
+        raise ValueError(f"unknown propagation model: {model}")
+    node_sectors = np.array(
+        [sector for _, sector in g.nodes(data="sector")], dtype=object
+    )
+    for scenario in scenarios.values():
+        get_sector_mask(node_sectors, scenario["sectors"])
+
+    dir = datetime.now().strftime("%Y_%m_%d_%H%M%S")
+    path = f"{scenarios_path}{dir}"
+    os.makedirs(path)
+    logging.debug(f"folder for the scenario run is created under the name {dir}")
+
+    start_time = time()
+    arrays = create_propagation_arrays(g)
+
+    items = list(scenarios.items())
+    cpu = cpu_count()
+    per_task = max(1, min(SIMULATION_BATCH_SIZE // draws, -(-len(items) // cpu)))
+    batches = [items[i : i + per_task] for i in range(0, len(items), per_task)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    func = partial(
+        simulate_scenario_batch,
+        arrays,
+        draws,
+        default_threshold,
+        model,
+        beta,
+        path,
+        save_realizations,
+    )
+    with Pool(min(cpu, len(batches))) as pool:
+        summary = pd.concat(pool.map(func, zip(batches, seeds)), ignore_index=True)
+
+    runtime = time() - start_time
+
+    summary.to_csv(f"{path}/scenario_summary.csv", index=False)
+    with open(f"{path}/scenarios.yaml", "w") as f:
+        yaml.dump(scenarios, f, sort_keys=False)
+
+    metadata = {
+        "date_of_run": dir,
+        "shock_distribution": "pareto, gaussian factor copula",
+        "no_of_scenarios": len(scenarios),
+        "default_threshold": default_threshold,
+        "no_of_iterations": draws,
+        "results_path": path,
+        "time elapsed": runtime,
+        "model": model,
+    }
+    if model == "fractional":
+        metadata["beta"] = beta
+
+    metadata_df = pd.DataFrame.from_dict(metadata, orient="index")
+    metadata_df.to_csv(f"{path}/metadata.csv", header=False)
+    logging.info(
+        f"{len(scenarios)} scenarios are evaluated with {draws} draws each. "
+        f"Elapsed time: {runtime} seconds"
+    )
+
+    if catalog_path is not None:
+        register_scenario_run(catalog_path, scenarios_path, dir)
+
+    return summary
+
+
 def simulate_shocks_for_one_sector(
     g: nx.Graph,
     alpha: float,
@@ -1,40 +1,180 @@
 from tempfile import TemporaryFile
+from collections.abc import Mapping, Sequence
+import hashlib
+import logging
 import pandas as pd
 import networkx as nx
 import os
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import feather
 
+from load.helpers import list_files, read_file, read_files_parallel
 
-def load_simulation_for_sector(sector_path):
+
+SIMULATION_COLUMNS = ["sector", "default_round"]
+RUN_SUMMARY_FILE = "summary.npz"
+
+
+def read_default_rounds(path):
+    """
+    Helper function that reads the default round column of one realization as an
+    integer array, where 0 marks the nodes that did not default.
+    """
+
+    table = feather.read_table(path, columns=["default_round"], memory_map=True)
+    column = table.column("default_round").cast(pa.int16())
+
+    return pc.fill_null(column, 0).to_numpy()
+
+
+class SectorRealizations(Sequence):
+    """
+    Lazy sequence of the realizations of one shocked sector. The files are only
+    listed on first access and every item is read when it is indexed.
+    """
+
+    def __init__(self, sector_path, columns=SIMULATION_COLUMNS):
+        self.sector_path = sector_path
+        self.columns = columns
+        self._files = None
+        self._default_rounds = None
+        self._node_sectors = None
+
+    @property
+    def files(self):
+        if self._files is None:
+            self._files = list_files(self.sector_path, ".feather")
+        return self._files
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return read_file(f"{self.sector_path}/{self.files[i]}", self.columns)
+
+    def default_rounds(self):
+        """
+        Returns the stacked (iterations x nodes) array of default rounds. The array
+        is built on first call and kept for later use.
+        """
+        if self._default_rounds is None:
+            self._default_rounds = np.stack(
+                read_files_parallel(
+                    [f"{self.sector_path}/{f}" for f in self.files],
+                    reader=read_default_rounds,
+                )
+            )
+        return self._default_rounds
+
+    def node_sectors(self):
+        """Returns the sector of every node in the order of the default rounds."""
+        if self._node_sectors is None:
+            df = read_file(f"{self.sector_path}/{self.files[0]}", ["sector"])
+            self._node_sectors = df["sector"].to_numpy()
+        return self._node_sectors
+
+
+class SimulationResults(Mapping):
+    """
+    Handle on the results of one simulation run. It behaves like a dictionary
+    where every key is a shocked sector and the values are lazy sequences of the
+    realizations, read with only the sector and default_round columns.
+    """
+
+    def __init__(self, simulations_path, run_folder, sector_list):
+        self.run_path = f"{simulations_path}/{run_folder}"
+        folders = os.listdir(self.run_path)
+        self.sectors = [f for f in sorted(folders) if f in sector_list]
+        self._realizations = {
+            sector: SectorRealizations(f"{self.run_path}/{sector}")
+            for sector in self.sectors
+        }
+
+    def __getitem__(self, sector):
+        return self._realizations[sector]
+
+    def __iter__(self):
+        return iter(self.sectors)
+
+    def __len__(self):
+        return len(self.sectors)
+
+    def default_rounds(self, sector):
+        return self._realizations[sector].default_rounds()
+
+    def node_sectors(self, sector):
+        return self._realizations[sector].node_sectors()
+
+
+def load_simulation_for_sector(sector_path, columns=None, max_workers=None):
     """
     Helper function to parse every simulation file to a list of dataframes
     """
 
-    df_list = []
-    for file in os.listdir(sector_path):
-        df_list.append(pd.read_feather(f"{sector_path}/{file}"))
+    df_list = read_files_parallel(
+        [f"{sector_path}/{file}" for file in list_files(sector_path, ".feather")],
+        columns=columns,
+        max_workers=max_workers,
+    )
 
     return df_list
 
 
 def load_simulation_for_all_sectors(simulations_path, run_folder, sector_list):
     """
-    Function that returns a dictionary where every key is a sector and the values
-    are lists of dataframes.
+    Function that returns a handle on the simulation run that can be used as a
+    dictionary where every key is a sector and the values are lazily read
+    sequences of dataframes.
     """
 
-    run_path = f"{simulations_path}/{run_folder}"
+    return SimulationResults(simulations_path, run_folder, sector_list)
 
-    folders = os.listdir(run_path)
-    sectors = [f for f in folders if f in sector_list]
 
-    sectors_dict = {}
+def get_default_rounds(df_list):
+    """
+    Helper function that returns the stacked (iterations x nodes) array of default
+    rounds, where 0 marks the nodes that did not default, and the sector of every
+    node. It accepts a lazy sequence of a simulation handle or a list of
+    dataframes of the same graph, where the node order is the same in every
+    realization.
+    """
 
-    for sector in sectors:
-        sector_path = f"{run_path}/{sector}"
-        sectors_dict[sector] = load_simulation_for_sector(sector_path)
+    if isinstance(df_list, SectorRealizations):
+        return df_list.default_rounds(), df_list.node_sectors()
 
-    return sectors_dict
+    rounds = np.stack(
+        [
+            np.nan_to_num(pd.to_numeric(df["default_round"]).to_numpy(float), nan=0)
+            for df in df_list
+        ]
+    ).astype(int)
+    node_sectors = df_list[0]["sector"].to_numpy()
+
+    return rounds, node_sectors
+
+
+def count_defaults_by_round_and_sector(rounds, sector_codes, no_sectors):
+    """
+    Helper function that counts the defaulted nodes of every realization in every
+    round and sector with one bincount on the combined (iteration, round, sector)
+    codes. The returned array has (iterations x rounds + 1 x sectors) shape, where
+    the index of the round axis is the default round and 0 holds the survivors.
+    """
+
+    no_iterations = rounds.shape[0]
+    no_rounds = int(rounds.max(initial=0)) + 1
+
+    iteration_codes = np.arange(no_iterations)[:, None] * no_rounds + rounds
+    codes = iteration_codes * no_sectors + sector_codes[None, :]
+    counts = np.bincount(
+        codes.ravel(), minlength=no_iterations * no_rounds * no_sectors
+    )
+
+    return counts.reshape(no_iterations, no_rounds, no_sectors)
 
 
 def count_defaults_each_round(df_list, percent=False) -> pd.DataFrame:
@@ -44,19 +184,17 @@ def count_defaults_each_round(df_list, percent=False) -> pd.DataFrame:
     each default round.
     """
 
-    result_list = []
-    for df in df_list:
-        result_dict = {}
-        res = df[~pd.isna(df.default_round)].groupby("default_round").count()["label"]
-        for i in range(0, len(res)):
+    rounds, _ = get_default_rounds(df_list)
+    counts = count_defaults_by_round_and_sector(
+        rounds, np.zeros(rounds.shape[1], dtype=int), 1
+    )[:, 1:, 0]
 
-            result_dict[res.index[i]] = res.iloc[i]
-        result_list.append(result_dict)
-
-    result_df = pd.DataFrame.from_records(result_list).fillna(0)
+    result_df = pd.DataFrame(
+        counts.astype(float), columns=range(1, counts.shape[1] + 1)
+    )
 
     if percent:
-        result_df = result_df / len(df_list[0]["label"]) * 100
+        result_df = result_df / rounds.shape[1] * 100
 
     return result_df
 
@@ -67,17 +205,12 @@ def calculate_cummulative_defaults(sectors_dict):
     shocked sector.
     """
     plot_dict = {}
-    for (sec, df_list) in sectors_dict.items():
-
-        defaulted_df = count_defaults_each_round(df_list)
+    for sec, fields in get_run_summary(sectors_dict).items():
 
-        # calculating cummulative sum of defaults
-        cumsum_df = defaulted_df.cumsum(axis=1)
-        # expressing cummulative defaults as percentage of total nodes
-        no_nodes = len(df_list[0]["label"])
-        cumsum_df = cumsum_df / no_nodes * 100
+        # calculating cummulative sum of defaults as percentage of total nodes
+        cumsum = np.cumsum(fields["rounds"], axis=1) / fields["no_nodes"] * 100
         # calculating the mean of each cummulative sum value
-        plot_dict[sec] = cumsum_df.mean(axis=0).to_dict()
+        plot_dict[sec] = dict(enumerate(cumsum.mean(axis=0).tolist(), start=1))
 
     # calculating highest default round
     len_longest_list = len(max(plot_dict.values(), key=lambda x: len(x)))
@@ -92,6 +225,30 @@ def calculate_cummulative_defaults(sectors_dict):
     return plot_dict
 
 
+def calculate_sector_default_shares(df_list, direct=False):
+    """
+    Helper function that returns the sectors of the graph in alphabetical order
+    and an (iterations x sectors) array with the percentage of defaulted nodes
+    in each sector. If direct is true, only the defaults in the second round
+    are counted.
+    """
+
+    rounds, node_sectors = get_default_rounds(df_list)
+    sector_names, sector_codes = np.unique(node_sectors, return_inverse=True)
+    no_sectors = len(sector_names)
+
+    counts = count_defaults_by_round_and_sector(rounds, sector_codes, no_sectors)
+    if direct:
+        defaulted = counts[:, 2, :] if counts.shape[1] > 2 else counts[:, 0, :] * 0
+    else:
+        defaulted = counts[:, 1:, :].sum(axis=1)
+
+    sector_sizes = np.bincount(sector_codes, minlength=no_sectors)
+    shares = defaulted / sector_sizes * 100
+
+    return sector_names, shares
+
+
 def calculate_effect_on_other_sectors(
     df_list, shocked_sector, include_self=False, direct=False
 ):
@@ -103,42 +260,12 @@ def calculate_effect_on_other_sectors(
     round are counted.
     """
 
-    result_dict = {}
-    for df in df_list:
-        if include_self:
-            sector_count = df.groupby("sector").count()["label"]
-
-            if direct:
-                res = df[(df.default_round == 2)].groupby("sector").count()["label"]
-            else:
-                res = (
-                    df[(~pd.isna(df.default_round))].groupby("sector").count()["label"]
-                )
-        else:
-            sector_count = (
-                df[df.sector != shocked_sector].groupby("sector").count()["label"]
-            )
+    sector_names, shares = calculate_sector_default_shares(df_list, direct)
 
-            if direct:
-                res = (
-                    df[(df.default_round == 2) & (df.sector != shocked_sector)]
-                    .groupby("sector")
-                    .count()["label"]
-                )
-            else:
-                res = (
-                    df[(~pd.isna(df.default_round)) & (df.sector != shocked_sector)]
-                    .groupby("sector")
-                    .count()["label"]
-                )
-
-        res = res / sector_count * 100  # values will be displayed as percentages
-        for i in range(0, len(res)):
-            try:
-                result_dict[res.index[i]].append(np.nan_to_num(res.iloc[i], nan=0))
-            except KeyError:
-                result_dict[res.index[i]] = []
-                result_dict[res.index[i]].append(np.nan_to_num(res.iloc[i], nan=0))
+    result_dict = {}
+    for i, sec in enumerate(sector_names):
+        if include_self or sec != shocked_sector:
+            result_dict[sec] = shares[:, i].tolist()
 
     return result_dict
 
@@ -179,6 +306,119 @@ def calculate_effect_from_other_sectors(sectors_dict, include_self=False):
     return result_dict
 
 
+def get_run_fingerprint(run_path, sector_list):
+    """
+    Helper function that fingerprints the contents of a run folder based on the
+    name, size and modification time of every realization and the metadata file.
+    """
+
+    h = hashlib.sha256()
+    for sector in sorted(os.listdir(run_path)):
+        if sector not in sector_list:
+            continue
+        with os.scandir(f"{run_path}/{sector}") as entries:
+            stats = sorted(
+                (e.name, e.stat().st_size, e.stat().st_mtime_ns)
+                for e in entries
+                if e.name.endswith(".feather")
+            )
+        h.update(repr((sector, stats)).encode())
+
+    if os.path.exists(f"{run_path}/metadata.csv"):
+        stat = os.stat(f"{run_path}/metadata.csv")
+        h.update(repr((stat.st_size, stat.st_mtime_ns)).encode())
+
+    return h.hexdigest()
+
+
+def create_run_summary(sectors_dict):
+    """
+    Function that summarizes a simulation run for every shocked sector: the
+    percentage of defaulted nodes in each target sector for every realization
+    (total and direct effect) and the number of defaults in each round.
+    """
+
+    summary = {}
+    for shocked_sector, df_list in sectors_dict.items():
+        rounds, node_sectors = get_default_rounds(df_list)
+        sector_names, sector_codes = np.unique(node_sectors, return_inverse=True)
+        no_sectors = len(sector_names)
+
+        counts = count_defaults_by_round_and_sector(rounds, sector_codes, no_sectors)
+        sector_sizes = np.bincount(sector_codes, minlength=no_sectors)
+
+        direct = np.zeros((rounds.shape[0], no_sectors))
+        if counts.shape[1] > 2:
+            direct = counts[:, 2, :] / sector_sizes * 100
+
+        summary[shocked_sector] = {
+            "sectors": sector_names.astype(str),
+            "total": counts[:, 1:, :].sum(axis=1) / sector_sizes * 100,
+            "direct": direct,
+            "rounds": counts[:, 1:, :].sum(axis=2),
+            "no_nodes": np.array(rounds.shape[1]),
+        }
+
+    return summary
+
+
+def load_run_summary(simulations_path, run_folder, sector_list):
+    """
+    Function that returns the summary of a simulation run. The summary is saved
+    to the run folder on first access and read from there later on, unless the
+    realizations or the metadata of the run have changed since.
+    """
+
+    run_path = f"{simulations_path}/{run_folder}"
+    summary_path = f"{run_path}/{RUN_SUMMARY_FILE}"
+    fingerprint = get_run_fingerprint(run_path, sector_list)
+
+    if os.path.exists(summary_path):
+        with np.load(summary_path) as data:
+            if str(data["fingerprint"]) == fingerprint:
+                summary = {}
+                for key in data.files:
+                    if key == "fingerprint":
+                        continue
+                    sector, field = key.rsplit("/", 1)
+                    summary.setdefault(sector, {})[field] = data[key]
+                logging.debug(f"run summary is read from {summary_path}")
+                return dict(sorted(summary.items()))
+
+    sectors_dict = load_simulation_for_all_sectors(
+        simulations_path, run_folder, sector_list
+    )
+    summary = create_run_summary(sectors_dict)
+
+    arrays = {
+        f"{sector}/{field}": value
+        for sector, fields in summary.items()
+        for field, value in fields.items()
+    }
+    tmp_path = f"{run_path}/{RUN_SUMMARY_FILE}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, fingerprint=np.array(fingerprint), **arrays)
+    os.replace(tmp_path, summary_path)
+    logging.info(f"run summary is written to {summary_path}")
+
+    return summary
+
+
+def calculate_effect_from_run_summary(summary, include_self=False, direct=False):
+    """
+    Function that returns the same nested dictionary as
+    calculate_effect_from_other_sectors, but computed from a run summary.
+    """
+
+    field = "direct" if direct else "total"
+    result_dict = {}
+    for shocked_sector, fields in summary.items():
+        for i, sec in enumerate(fields["sectors"]):
+            if include_self or sec != shocked_sector:
+                result_dict.setdefault(sec, {})[shocked_sector] = fields[field][:, i]
+
+    return dict(sorted(result_dict.items()))
+
+
 def sort_dictionary_by_mean_of_list(d):
     """
     Helper function that orders the dictionary based on the mean of the list that
@@ -190,19 +430,186 @@ def sort_dictionary_by_mean_of_list(d):
     return ret_dict
 
 
+def get_run_summary(sectors_dict):
+    """
+    Helper function that returns the run summary of a simulation handle or of a
+    dictionary of dataframe lists. Summaries are returned unchanged.
+    """
+
+    if all(isinstance(v, dict) for v in sectors_dict.values()):
+        return sectors_dict
+
+    return create_run_summary(sectors_dict)
+
+
+def bootstrap_mean_interval(values, n_boot=1000, ci=0.95, batch_size=100, seed=None):
+    """
+    Helper function that calculates bootstrap confidence intervals for the mean
+    of every column of an (iterations x columns) array. The iteration indices are
+    resampled in batches and turned into resampling weights with one bincount,
+    so every batch of bootstrap means is a single matrix product.
+    """
+
+    rng = np.random.default_rng(seed)
+    no_iterations = values.shape[0]
+
+    boot_means = []
+    for start in range(0, n_boot, batch_size):
+        size = min(batch_size, n_boot - start)
+        idx = rng.integers(0, no_iterations, (size, no_iterations))
+        codes = np.arange(size)[:, None] * no_iterations + idx
+        weights = np.bincount(codes.ravel(), minlength=size * no_iterations)
+        weights = weights.reshape(size, no_iterations)
+        boot_means.append(weights @ values / no_iterations)
+    boot_means = np.concatenate(boot_means)
+
+    lower = np.percentile(boot_means, (1 - ci) / 2 * 100, axis=0)
+    upper = np.percentile(boot_means, (1 + ci) / 2 * 100, axis=0)
+
+    return lower, upper
+
+
+def calculate_pairwise_effect_matrix(
+    sectors_dict,
+    include_self=False,
+    direct=False,
+    n_boot=0,
+    ci=0.95,
+    batch_size=100,
+    seed=None,
+):
+    """
+    Function that calculates the mean percentage of defaulted nodes in every
+    target sector (rows) for the shocks on every shocked sector (columns). The
+    input is a simulation handle, a dictionary of dataframe lists or a run
+    summary. If n_boot is positive, bootstrap confidence intervals of the means
+    are calculated as well. The returned dictionary contains the sector labels,
+    the mean matrix and the lower and upper bounds.
+    """
+
+    summary = get_run_summary(sectors_dict)
+
+    field = "direct" if direct else "total"
+    shocked = sorted(summary.keys())
+    targets = sorted({sec for fields in summary.values() for sec in fields["sectors"]})
+    target_index = {sec: i for i, sec in enumerate(targets)}
+
+    m = np.zeros((len(targets), len(shocked)))
+    lower = np.zeros_like(m)
+    upper = np.zeros_like(m)
+    for j, shocked_sector in enumerate(shocked):
+        fields = summary[shocked_sector]
+        rows = [target_index[sec] for sec in fields["sectors"]]
+        m[rows, j] = fields[field].mean(axis=0)
+        if n_boot > 0:
+            lower[rows, j], upper[rows, j] = bootstrap_mean_interval(
+                fields[field], n_boot, ci, batch_size, seed
+            )
+
+    if not include_self:
+        for j, shocked_sector in enumerate(shocked):
+            if shocked_sector in target_index:
+                i = target_index[shocked_sector]
+                m[i, j], lower[i, j], upper[i, j] = 0, 0, 0
+
+    ret_dict = {"targets": targets, "shocked": shocked, "mean": m}
+    if n_boot > 0:
+        ret_dict["lower"] = lower
+        ret_dict["upper"] = upper
+
+    return ret_dict
+
+
 def calculate_pairwise_effect_for_heatmap(sectors_dict, include_self=False):
     """
     Function to calculate pairwise average effect of sectors on each other.
     """
 
-    result_dict = calculate_effect_from_other_sectors(sectors_dict, include_self=True)
-    sector_list = sorted(list(sectors_dict.keys()))
+    return calculate_pairwise_effect_matrix(sectors_dict, include_self)["mean"]
 
-    m = np.zeros((10, 10))
-    for i, s in enumerate(sector_list):
-        for j, se in enumerate(sector_list):
-            m[i, j] = np.mean(result_dict[s][se])
 
-    if not include_self:
-        np.fill_diagonal(m, 0)
-    return m
+def calculate_boxplot_stats(values, labels, whis=1.5, outliers=True):
+    """
+    Function that calculates the boxplot statistics (quartiles, whiskers, mean
+    and optionally the outliers) of every column of an (iterations x groups)
+    array in one vectorized pass. The whiskers follow matplotlib's convention,
+    they reach the most extreme values within whis times the interquartile range.
+    The returned list can be drawn with matplotlib's Axes.bxp.
+    """
+
+    values = np.asarray(values, dtype=float)
+    q1, med, q3 = np.percentile(values, [25, 50, 75], axis=0)
+    iqr = q3 - q1
+
+    lower_limit = np.where(values >= q1 - whis * iqr, values, np.inf).min(axis=0)
+    upper_limit = np.where(values <= q3 + whis * iqr, values, -np.inf).max(axis=0)
+    whislo = np.where(np.isfinite(lower_limit), lower_limit, q1)
+    whishi = np.where(np.isfinite(upper_limit), upper_limit, q3)
+    means = values.mean(axis=0)
+    flier_mask = (values < whislo) | (values > whishi)
+
+    stats = []
+    for j, label in enumerate(labels):
+        stat = {
+            "label": label,
+            "q1": q1[j],
+            "med": med[j],
+            "q3": q3[j],
+            "whislo": whislo[j],
+            "whishi": whishi[j],
+            "mean": means[j],
+            "fliers": np.array([]),
+        }
+        if outliers:
+            stat["fliers"] = values[flier_mask[:, j], j]
+        stats.append(stat)
+
+    return stats
+
+
+def summarize_defaults(sectors_dict, method, outliers=True):
+    """
+    Function that calculates the boxplot statistics for plot_defaults for every
+    shocked sector. With the rounds method the percentage of defaulted firms in
+    each round is summarized, with sectors_direct and sectors_total the
+    percentage of defaulted firms in every other sector.
+    """
+
+    summary = get_run_summary(sectors_dict)
+
+    stats = {}
+    for sec, fields in summary.items():
+        if method == "rounds":
+            values = fields["rounds"] / fields["no_nodes"] * 100
+            labels = list(range(1, values.shape[1] + 1))
+        else:
+            field = "direct" if method == "sectors_direct" else "total"
+            keep = fields["sectors"] != sec
+            values = fields[field][:, keep]
+            labels = list(fields["sectors"][keep])
+
+        stats[sec] = calculate_boxplot_stats(values, labels, outliers=outliers)
+
+    return stats
+
+
+def summarize_effect_from_other_sectors(sectors_dict, outliers=True):
+    """
+    Function that calculates the boxplot statistics of the percentage of
+    defaulted firms in every sector for the shocks on the other sectors. The
+    shocked sectors are ordered by their mean effect.
+    """
+
+    result_dict = calculate_effect_from_run_summary(get_run_summary(sectors_dict))
+
+    stats = {}
+    for sec, def_dict in result_dict.items():
+        # (iterations x shocked sectors) array, ordered by the mean effect
+        values = np.column_stack(list(def_dict.values()))
+        order = np.argsort(-values.mean(axis=0), kind="stable")
+        labels = list(np.array(list(def_dict), dtype=object)[order])
+        stats[sec] = calculate_boxplot_stats(
+            values[:, order], labels, outliers=outliers
+        )
+
+    return stats
@@ -2,17 +2,16 @@ import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
 import networkx as nx
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import networkx as nx
 
 from .plot_helpers import (
-    calculate_effect_on_other_sectors,
-    count_defaults_each_round,
     calculate_cummulative_defaults,
-    calculate_effect_from_other_sectors,
-    sort_dictionary_by_mean_of_list,
-    calculate_pairwise_effect_for_heatmap,
+    calculate_pairwise_effect_matrix,
+    summarize_defaults,
+    summarize_effect_from_other_sectors,
 )
 
 
@@ -184,7 +183,7 @@ def plot_sector_network_info(sector_df, x, y, siz):
     return fig
 
 
-def plot_defaults(sectors_dict, sector, method):
+def plot_defaults(sectors_dict, sector, method, stats=None, outliers=True):
     """
     General function that plots
     a) effects from one shocked sector on one plot
@@ -194,46 +193,48 @@ def plot_defaults(sectors_dict, sector, method):
     shock resulting from one given industry.
     - sectors_total:
     - sectors_direct:
-
+    The boxplots are drawn from precomputed statistics, that can be given with
+    the stats parameter (see summarize_defaults), otherwise they are calculated
+    from sectors_dict.
     """
 
+    if stats is None:
+        stats = summarize_defaults(sectors_dict, method, outliers=outliers)
+
     if sector == "all":
         fig, axes = plt.subplots(5, 2, figsize=(20, 30))
 
-        for i, (sec, df_list) in enumerate(sectors_dict.items()):
+        for i, (sec, sec_stats) in enumerate(stats.items()):
 
             if method == "rounds":
-                defaulted_df = count_defaults_each_round(df_list, percent=True)
                 fig.suptitle(
                     f"Percentage of defaulted firms from shocks on different sectors",
                     size=20,
                 )
-                axes.flatten()[i].boxplot(defaulted_df)
+                axes.flatten()[i].bxp(sec_stats, showfliers=outliers)
                 axes.flatten()[i] = add_axes_attributes(axes.flatten()[i])
 
             elif method == "sectors_direct":
-                defaulted_dict = calculate_effect_on_other_sectors(
-                    df_list, sec, direct=True
-                )
                 fig.suptitle(
                     f"Percentage of defaulted firms in each sector from shocks on different sectors \nDirect effect",
                     size=20,
                 )
-                axes.flatten()[i].boxplot(defaulted_dict.values())
-                axes.flatten()[i].set_xticklabels(defaulted_dict.keys(), rotation=90)
+                axes.flatten()[i].bxp(sec_stats, showfliers=outliers)
+                axes.flatten()[i].set_xticklabels(
+                    [st["label"] for st in sec_stats], rotation=90
+                )
 
                 axes.flatten()[i] = add_axes_attributes_sector(axes.flatten()[i])
 
             elif method == "sectors_total":
-                defaulted_dict = calculate_effect_on_other_sectors(
-                    df_list, sec, direct=False
-                )
                 fig.suptitle(
                     f"Percentage of defaulted firms in each sector from shocks on different sectors \nTotal effect",
                     size=20,
                 )
-                axes.flatten()[i].boxplot(defaulted_dict.values())
-                axes.flatten()[i].set_xticklabels(defaulted_dict.keys(), rotation=90)
+                axes.flatten()[i].bxp(sec_stats, showfliers=outliers)
+                axes.flatten()[i].set_xticklabels(
+                    [st["label"] for st in sec_stats], rotation=90
+                )
 
                 axes.flatten()[i] = add_axes_attributes_sector(axes.flatten()[i])
 
@@ -246,29 +247,26 @@ def plot_defaults(sectors_dict, sector, method):
         fig.subplots_adjust(top=0.95)
 
     else:
-        df_list = sectors_dict[sector]
+        sec_stats = stats[sector]
         fig, ax = plt.subplots(figsize=(12, 9))
 
         if method == "rounds":
-            defaulted_df = count_defaults_each_round(df_list, percent=True)
-            ax.boxplot(defaulted_df)
+            ax.bxp(sec_stats, showfliers=outliers)
             ax = add_axes_attributes(ax)
             ax.set_title(
                 f"Defaulted firms in each round from {sector} sector's shocks", size=16
             )
 
         elif method == "sectors_direct":
-            defaulted_dict = calculate_effect_on_other_sectors(
-                df_list, sector, direct=True
-            )
-            ax.boxplot(
-                defaulted_dict.values(),
+            ax.bxp(
+                sec_stats,
+                showfliers=outliers,
                 meanline=True,
                 showmeans=True,
                 meanprops=dict(linewidth=2.5),
                 medianprops=dict(linewidth=2.5),
             )
-            ax.set_xticklabels(defaulted_dict.keys(), rotation=45)
+            ax.set_xticklabels([st["label"] for st in sec_stats], rotation=45)
 
             ax = add_axes_attributes_sector(ax)
             ax.set_title(
@@ -276,17 +274,17 @@ def plot_defaults(sectors_dict, sector, method):
             )
 
         elif method == "sectors_total":
-            defaulted_dict = calculate_effect_on_other_sectors(
-                df_list, sector, direct=False
-            )
-            bp = ax.boxplot(
-                defaulted_dict.values(),
+            bp = ax.bxp(
+                sec_stats,
+                showfliers=outliers,
                 meanline=True,
                 showmeans=True,
                 meanprops=dict(linewidth=2.5),
                 medianprops=dict(linewidth=2.5, color="darkred"),
             )
-            ax.set_xticklabels(defaulted_dict.keys(), rotation=45, ha="right")
+            ax.set_xticklabels(
+                [st["label"] for st in sec_stats], rotation=45, ha="right"
+            )
 
             ax = add_axes_attributes_boxplot(ax)
             ax.set_title(
@@ -339,11 +337,17 @@ def add_axes_attributes_sector(ax):
     return ax
 
 
-def plot_cummulative_defaults(sectors_dict):
+def plot_cummulative_defaults(sectors_dict, plot_dict=None):
+    """
+    The function plots the mean cummulative defaults in each round for every
+    shocked sector. The means can be given precomputed with plot_dict (see
+    calculate_cummulative_defaults).
+    """
 
     fig, ax = plt.subplots(figsize=(12, 9))
 
-    plot_dict = calculate_cummulative_defaults(sectors_dict)
+    if plot_dict is None:
+        plot_dict = calculate_cummulative_defaults(sectors_dict)
 
     for sector, def_dict in plot_dict.items():
         ax.plot(
@@ -376,24 +380,30 @@ def plot_cummulative_defaults(sectors_dict):
     return fig
 
 
-def plot_effect_on_sectors_from_other_sectors(sectors_dict, sectors="all"):
+def plot_effect_on_sectors_from_other_sectors(
+    sectors_dict, sectors="all", stats=None, outliers=True
+):
     """
     This function returns a plot where each subplot contains information on
     how one given sector(one sublot) is effected from shocks in other sectors(x axis).
     On the y axis the percentages of defaulted firms in the given sector are displayed.
+    The boxplot statistics can be given precomputed with the stats parameter
+    (see summarize_effect_from_other_sectors).
     """
 
-    result_dict = calculate_effect_from_other_sectors(sectors_dict)
+    if stats is None:
+        stats = summarize_effect_from_other_sectors(sectors_dict, outliers=outliers)
 
     if sectors == "all":
         fig, axes = plt.subplots(5, 2, figsize=(20, 30))
 
-        for i, (sec, def_dict) in enumerate(result_dict.items()):
-            def_dict = sort_dictionary_by_mean_of_list(def_dict)
+        for i, (sec, sec_stats) in enumerate(stats.items()):
 
-            axes.flatten()[i].boxplot(def_dict.values())
+            axes.flatten()[i].bxp(sec_stats, showfliers=outliers)
 
-            axes.flatten()[i].set_xticklabels(def_dict.keys(), rotation=45)
+            axes.flatten()[i].set_xticklabels(
+                [st["label"] for st in sec_stats], rotation=45
+            )
             axes.flatten()[i] = add_axes_attributes_sector(axes.flatten()[i])
             axes.flatten()[i].set_title(f"{sec}", size=16)
             axes.flatten()[i].yaxis.set_major_formatter(
@@ -410,20 +420,36 @@ def plot_effect_on_sectors_from_other_sectors(sectors_dict, sectors="all"):
     return fig
 
 
-def plot_pairwise_effect(sectors_dict, include_self=False):
+def plot_pairwise_effect(
+    sectors_dict, include_self=False, n_boot=0, ci=0.95, effect_dict=None
+):
+    """
+    The function plots the heatmap of the average percentage of defaulted firms
+    in each target sector based on the shocked sector. If n_boot is positive, the
+    cells are annotated with the bootstrap confidence interval of the mean. The
+    matrix can be given precomputed with effect_dict (see
+    calculate_pairwise_effect_matrix).
+    """
 
-    plot_matrix = calculate_pairwise_effect_for_heatmap(
-        sectors_dict, include_self=include_self
-    )
+    if effect_dict is None:
+        effect_dict = calculate_pairwise_effect_matrix(
+            sectors_dict, include_self=include_self, n_boot=n_boot, ci=ci
+        )
+    plot_matrix = effect_dict["mean"]
 
     fig, ax = plt.subplots(figsize=(12, 9))
 
-    sector_list = sorted(list(sectors_dict.keys()))
     cmap = sns.cm.rocket_r
 
-    sns.heatmap(plot_matrix, ax=ax, cmap=cmap)
-    ax.set_xticklabels(sector_list, rotation=45, ha="right", fontsize=20)
-    ax.set_yticklabels(sector_list, fontsize=20, rotation=0)
+    annot = False
+    if "lower" in effect_dict:
+        annot = np.vectorize(lambda m, lo, up: f"{m:.1f}\n[{lo:.1f}, {up:.1f}]")(
+            plot_matrix, effect_dict["lower"], effect_dict["upper"]
+        )
+
+    sns.heatmap(plot_matrix, ax=ax, cmap=cmap, annot=annot, fmt="")
+    ax.set_xticklabels(effect_dict["shocked"], rotation=45, ha="right", fontsize=20)
+    ax.set_yticklabels(effect_dict["targets"], fontsize=20, rotation=0)
 
     ax.set_xlabel("Shocked sector", size=20, fontweight="bold")
     ax.set_ylabel("Target sector", size=20, fontweight="bold")
@@ -0,0 +1,194 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
+
+import matplotlib.pyplot as plt
+
+from load.helpers import parse_yaml
+from .plot_helpers import (
+    calculate_cummulative_defaults,
+    calculate_pairwise_effect_matrix,
+    load_run_summary,
+    summarize_defaults,
+    summarize_effect_from_other_sectors,
+)
+from .plotting import (
+    plot_cummulative_defaults,
+    plot_defaults,
+    plot_effect_on_sectors_from_other_sectors,
+    plot_pairwise_effect,
+)
+
+
+logging.basicConfig(
+    filename="logs/graph.log",
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+    force=True,
+)
+
+
+def get_sweep_index(simulations_path):
+    """
+    Helper function that lists every run folder in the simulations folder, the
+    name of a run is its folder name.
+    """
+
+    return {
+        folder: folder
+        for folder in sorted(os.listdir(simulations_path))
+        if os.path.exists(f"{simulations_path}/{folder}/metadata.csv")
+    }
+
+
+def render_run_report(
+    run_name, run_folder, simulations_path, sector_list, plots_path, dpi=300
+):
+    """
+    Function that renders every simulation figure of one run and saves them to
+    the plots_path/run_name folder. The statistics are calculated once from the
+    run summary and shared between the figures. Returns the paths of the saved
+    figures.
+    """
+
+    start_time = time()
+    run_plots_path = f"{plots_path}{run_name}"
+    os.makedirs(run_plots_path, exist_ok=True)
+
+    summary = load_run_summary(simulations_path, run_folder, sector_list)
+    rounds_stats = summarize_defaults(summary, "rounds")
+    direct_stats = summarize_defaults(summary, "sectors_direct")
+    total_stats = summarize_defaults(summary, "sectors_total")
+
+    figures = {
+        "defaults_rounds": lambda: plot_defaults(
+            None, "all", "rounds", stats=rounds_stats
+        ),
+        "defaults_direct": lambda: plot_defaults(
+            None, "all", "sectors_direct", stats=direct_stats
+        ),
+        "defaults_total": lambda: plot_defaults(
+            None, "all", "sectors_total", stats=total_stats
+        ),
+        "cummdef": lambda: plot_cummulative_defaults(
+            None, plot_dict=calculate_cummulative_defaults(summary)
+        ),
+        "heatmap": lambda: plot_pairwise_effect(
+            None, effect_dict=calculate_pairwise_effect_matrix(summary)
+        ),
+        "effect_from_other_sectors": lambda: plot_effect_on_sectors_from_other_sectors(
+            None, stats=summarize_effect_from_other_sectors(summary)
+        ),
+    }
+    for sector in summary.keys():
+        name = sector.strip().lower().replace(" ", "_")
+        figures[f"defaults_total_{name}"] = lambda sector=sector: plot_defaults(
+            None, sector, "sectors_total", stats=total_stats
+        )
+
+    paths = []
+    for name, draw in figures.items():
+        fig = draw()
+        path = f"{run_plots_path}/{name}_{run_name}.png"
+        fig.savefig(path, bbox_inches="tight", dpi=dpi)
+        plt.close(fig)
+        paths.append(path)
+
+    logging.info(
+        f"{len(paths)} figures are rendered for {run_name} in {time() - start_time:.1f} seconds"
+    )
+
+    return paths
+
+
+def build_reports(
+    output_map,
+    simulations_path,
+    sector_list,
+    plots_path,
+    processes=None,
+    dpi=300,
+):
+    """
+    Function that renders the figures of every run in the output map (name:
+    run folder) in parallel, one run per worker process. If output_map is None,
+    every run in the simulations folder is rendered. Returns a dictionary of
+    the saved figure paths for each run. Runs that fail are logged and, once
+    every other run is finished, a RuntimeError listing them is raised.
+    """
+
+    if output_map is None:
+        output_map = get_sweep_index(simulations_path)
+
+    ret_dict = {}
+    failures = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            executor.submit(
+                render_run_report,
+                run_name,
+                run_folder,
+                simulations_path,
+                sector_list,
+                plots_path,
+                dpi,
+            ): run_name
+            for run_name, run_folder in output_map.items()
+        }
+        for future in as_completed(futures):
+            run_name = futures[future]
+            try:
+                ret_dict[run_name] = future.result()
+            except Exception as e:
+                logging.error(
+                    f"the following error occured when rendering figures for {run_name}: {e}"
+                )
+                failures[run_name] = e
+
+    if failures:
+        raise RuntimeError(
+            "rendering figures failed for the following runs: "
+            + ", ".join(f"{run_name} ({e!r})" for run_name, e in failures.items())
+        ) from next(iter(failures.values()))
+
+    return {
+        run_name: ret_dict[run_name] for run_name in output_map if run_name in ret_dict
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render the simulation figures of every run without notebooks."
+    )
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument(
+        "--runs", nargs="*", help="names of runs in output_map, all if not given"
+    )
+    parser.add_argument(
+        "--all-folders",
+        action="store_true",
+        help="render every run folder in the simulations folder instead of output_map",
+    )
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--dpi", type=int, default=300)
+    args = parser.parse_args()
+
+    config_dict = parse_yaml(args.config)
+    output_map = None if args.all_folders else config_dict["output_map"]
+    if output_map is not None and args.runs:
+        output_map = {run: output_map[run] for run in args.runs}
+
+    build_reports(
+        output_map,
+        config_dict["outputs"]["simulations"],
+        config_dict["lists"]["sectors"],
+        config_dict["outputs"]["plots"],
+        processes=args.processes,
+        dpi=args.dpi,
+    )
@@ -0,0 +1,324 @@
+import argparse
+import json
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+import networkx as nx
+import numpy as np
+
+from .create import get_largest_cc
+from .model import (
+    aggregate_by_sector,
+    create_propagation_arrays,
+    generate_joint_shocks_from_pareto,
+    get_sector_mask,
+    propagate_shock_batch,
+)
+
+
+logging.basicConfig(
+    filename="logs/shock_simulation.log",
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+    force=True,
+)
+
+MAX_DRAWS = 10_000
+
+
+def check_loss(loss):
+    """
+    Helper function that returns the loss as a float if it is a number between
+    0 and 1 (the share of assets lost), otherwise raises ValueError.
+    """
+
+    if isinstance(loss, bool) or not isinstance(loss, (int, float)):
+        raise ValueError(f"loss must be a number between 0 and 1, got {loss!r}")
+    if not 0 <= loss <= 1:
+        raise ValueError(f"loss must be between 0 and 1, got {loss}")
+
+    return float(loss)
+
+
+def load_stress_test_graph(graph_path):
+    """
+    Function that reads the projected graph and prepares it for the shock
+    simulation the same way as the run_shocks notebook: equity and liabilities
+    are converted to thousands like the assets and the largest connected
+    component is kept.
+    """
+
+    g = nx.read_gexf(graph_path)
+    for node in g.nodes():
+        g.nodes[node]["equity"] /= 1000
+        g.nodes[node]["liabilities"] /= 1000
+
+    return get_largest_cc(g)
+
+
+class StressTestEngine:
+    """
+    Propagation engine that keeps the arrays of the graph in memory and answers
+    what-if questions: an explicit shock for a set of nodes (the share of their
+    assets they lose), pareto shocks for a sector or joint shocks for several
+    sectors (see generate_joint_shocks_from_pareto), with the default cascade or
+    the fractional model. A scenario is a dictionary:
+
+        {"shocks": {"exxon_mobil": 0.3, ...}}
+        {"sector": "Energy", "loss": 0.3}
+        {"sector": "Energy", "alpha": 1.8, "scale": 0.1, "draws": 1000, "seed": 1}
+        {"sectors": ["Energy", "Materials"], "alpha": 1.8, "scale": 0.1,
+         "market_correlation": 0.3, "sector_correlation": 0.3, "draws": 1000}
+
+    with the optional keys default_threshold, model ("default" or "fractional")
+    and beta. The arrays are only read, so the engine can serve parallel
+    requests.
+    """
+
+    def __init__(self, g, default_threshold=0.4):
+        self.default_threshold = default_threshold
+        self.arrays = create_propagation_arrays(g)
+        self.nodes = self.arrays["nodes"]
+        self.index = {n: i for i, n in enumerate(self.nodes)}
+        self.node_sectors = self.arrays["attributes"]["sector"].to_numpy(dtype=object)
+        self.sectors = sorted(set(self.node_sectors))
+        self.sector_codes = np.array(
+            [self.sectors.index(s) for s in self.node_sectors], dtype=int
+        )
+        self.sector_sizes = np.bincount(self.sector_codes, minlength=len(self.sectors))
+
+    def describe(self):
+        """Returns the size of the graph and the number of nodes in every sector."""
+
+        return {
+            "nodes": len(self.nodes),
+            "edges": int(self.arrays["adjacency"].nnz // 2),
+            "default_threshold": self.default_threshold,
+            "sectors": dict(zip(self.sectors, self.sector_sizes.tolist())),
+        }
+
+    def create_asset_losses(self, scenario):
+        """
+        Returns the (draws x nodes) array of the share of assets lost by every
+        node in every draw of the scenario. Explicit losses must be between 0
+        and 1.
+        """
+
+        n = len(self.nodes)
+        if "shocks" in scenario:
+            losses = np.zeros((1, n))
+            for node, loss in scenario["shocks"].items():
+                if node not in self.index:
+                    raise ValueError(f"unknown node: {node}")
+                losses[0, self.index[node]] = check_loss(loss)
+            return losses
+
+        sectors = scenario.get("sectors", [scenario.get("sector")])
+        mask = get_sector_mask(self.node_sectors, sectors)
+
+        if "loss" in scenario:
+            losses = np.zeros((1, n))
+            losses[0, mask] = check_loss(scenario["loss"])
+            return losses
+
+        draws = int(scenario.get("draws", 1))
+        if not 0 < draws <= MAX_DRAWS:
+            raise ValueError(f"draws must be between 1 and {MAX_DRAWS}")
+        shocks = generate_joint_shocks_from_pareto(
+            self.node_sectors,
+            sectors,
+            scenario["alpha"],
+            scenario["scale"],
+            draws,
+            scenario.get("market_correlation", 0.0),
+            scenario.get("sector_correlation", 0.0),
+            np.random.default_rng(scenario.get("seed")),
+        )
+
+        return 1 - np.exp(-shocks)
+
+    def run(self, scenario):
+        """
+        Runs a scenario and returns the defaulted nodes with their default round
+        (for a single draw) and the sector aggregates averaged over the draws:
+        the number and ratio of defaulted nodes and the lost equity.
+        """
+
+        start_time = time()
+        default_threshold = scenario.get("default_threshold", self.default_threshold)
+        model = scenario.get("model", "default")
+
+        asset_losses = self.create_asset_losses(scenario)
+        equity, default_round = propagate_shock_batch(
+            self.arrays,
+            asset_losses,
+            default_threshold,
+            model,
+            scenario.get("beta", 0.5),
+        )
+
+        result = {
+            "draws": len(asset_losses),
+            "model": model,
+            "default_threshold": default_threshold,
+            "sectors": self.summarize_by_sector(
+                default_round, self.arrays["equity"] - equity
+            ),
+        }
+        if len(asset_losses) == 1:
+            defaulted = np.flatnonzero(default_round[0])
+            result["defaults"] = {
+                self.nodes[i]: int(default_round[0, i]) for i in defaulted
+            }
+        result["elapsed_ms"] = (time() - start_time) * 1000
+
+        return result
+
+    def summarize_by_sector(self, default_round, equity_loss):
+        """
+        Returns the mean number and ratio of defaulted nodes and the mean lost
+        equity of every sector over the draws.
+        """
+
+        defaults, losses = aggregate_by_sector(
+            default_round, equity_loss, self.sector_codes, len(self.sectors)
+        )
+
+        return {
+            sector: {
+                "defaults": float(defaults[:, i].mean()),
+                "default_ratio": float(defaults[:, i].mean() / self.sector_sizes[i]),
+                "equity_loss": float(losses[:, i].mean()),
+            }
+            for i, sector in enumerate(self.sectors)
+        }
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def get_request(self):
+        # the http handler expects a (host, port) client address
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+class StressTestServer:
+    """
+    Long running local service that answers what-if questions with a warm
+    StressTestEngine, over http on localhost or on a unix socket.
+
+        GET  /describe   size of the graph and the sectors
+        POST /scenario   runs the scenario in the json body
+
+    Example:
+        with StressTestServer(engine, port=8050) as server:
+            requests.post(f"{server.url}scenario", json={"sector": "Energy", "loss": 0.3})
+    """
+
+    def __init__(self, engine, host="127.0.0.1", port=0, socket_path=None):
+        self.engine = engine
+        self.socket_path = socket_path
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.server = ThreadingUnixHTTPServer(socket_path, self.create_handler())
+        else:
+            self.server = ThreadingHTTPServer((host, port), self.create_handler())
+            self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        if self.socket_path is not None:
+            return f"unix://{self.socket_path}"
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f"stress test service is listening at {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def create_handler(self):
+        engine = self.engine
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status, content):
+                body = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/describe":
+                    self.send_json(200, engine.describe())
+                else:
+                    self.send_json(404, {"error": f"unknown path: {self.path}"})
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/scenario":
+                    self.send_json(404, {"error": f"unknown path: {self.path}"})
+                    return
+
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    scenario = json.loads(self.rfile.read(length))
+                    result = engine.run(scenario)
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+
+                logging.debug(
+                    f"scenario {scenario} is answered in {result['elapsed_ms']:.1f} ms"
+                )
+                self.send_json(200, result)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve what-if shock scenarios on the projected graph."
+    )
+    parser.add_argument("graph_path")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--socket", default=None)
+    parser.add_argument("--default-threshold", type=float, default=0.4)
+    args = parser.parse_args()
+
+    engine = StressTestEngine(
+        load_stress_test_graph(args.graph_path), args.default_threshold
+    )
+    server = StressTestServer(engine, port=args.port, socket_path=args.socket)
+    server.start()
+    print(f"serving {args.graph_path} at {server.url}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,197 @@
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logging.basicConfig(
+    filename="logs/load_13f.log",
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+
+class EdgarStubServer:
+    """
+    Local stand-in for EDGAR that serves the filings of a folder with the
+    downloader layout (cik/13F-HR/accession/full-submission.txt) through the
+    submissions api (/submissions/CIK##########.json) and the archives
+    (/Archives/edgar/data/cik/accession/accession.txt). The time of every
+    request is recorded to check the request rate of a client, and failures
+    (503 responses) and latency can be injected to test retries and throughput.
+
+    Example:
+        with EdgarStubServer("data/13f/sec-edgar-filings/", failure_rate=0.1) as server:
+            download_13f_filings(..., submissions_url=server.submissions_url,
+                                 archives_url=server.archives_url)
+        server.max_requests_per_second()
+    """
+
+    def __init__(
+        self, filings_folder, port=0, failure_rate=0.0, latency=0.0, seed=None
+    ):
+        self.filings_folder = filings_folder
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = []
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/"
+
+    @property
+    def submissions_url(self):
+        return f"{self.url}submissions/"
+
+    @property
+    def archives_url(self):
+        return f"{self.url}Archives/edgar/data/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(
+            f"EDGAR stub server is serving {self.filings_folder} at {self.url}"
+        )
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def find_cik_folder(self, cik):
+        """Returns the folder of a cik, the folder names may have leading zeros."""
+
+        for folder in os.listdir(self.filings_folder):
+            if folder.isdigit() and int(folder) == cik:
+                return f"{self.filings_folder}{folder}/13F-HR"
+
+    def get_submissions(self, cik):
+        folder = self.find_cik_folder(cik)
+        if folder is None:
+            return None
+
+        accessions = sorted(os.listdir(folder), reverse=True)
+        return json.dumps(
+            {
+                "cik": str(cik),
+                "filings": {
+                    "recent": {
+                        "accessionNumber": accessions,
+                        "form": ["13F-HR"] * len(accessions),
+                    }
+                },
+            }
+        ).encode()
+
+    def get_full_submission(self, cik, accession):
+        folder = self.find_cik_folder(cik)
+        if folder is None:
+            return None
+
+        path = f"{folder}/{accession}/full-submission.txt"
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def route(self, path):
+        """Returns the content for a request path, None if it does not exist."""
+
+        parts = path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "submissions":
+            name = parts[1]
+            if name.startswith("CIK") and name.endswith(".json"):
+                return self.get_submissions(int(name[3:-5]))
+        elif len(parts) == 6 and parts[:3] == ["Archives", "edgar", "data"]:
+            return self.get_full_submission(int(parts[3]), parts[5][:-4])
+
+    def create_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests.append((time.monotonic(), self.path))
+                    failed = stub.random.random() < stub.failure_rate
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if failed:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                content = stub.route(self.path)
+                if content is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def max_requests_per_second(self, window=1.0):
+        """Returns the largest number of requests received in any window."""
+
+        with self.lock:
+            times = sorted(t for t, _ in self.requests)
+
+        ret = 0
+        start = 0
+        for end, t in enumerate(times):
+            while t - times[start] >= window:
+                start += 1
+            ret = max(ret, end - start + 1)
+
+        return ret / window
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a folder of 13f filings through an EDGAR-like http api."
+    )
+    parser.add_argument("filings_folder")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = EdgarStubServer(
+        args.filings_folder,
+        port=args.port,
+        failure_rate=args.failure_rate,
+        latency=args.latency,
+    )
+    server.start()
+    print(f"serving {args.filings_folder} at {server.url}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
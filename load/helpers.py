@@ -2,6 +2,11 @@ import yaml
 import os
 import pandas as pd
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import time
+from pyarrow import feather
 
 logging.basicConfig(
     filename="logs/load.log",
@@ -19,85 +24,261 @@ def parse_yaml(config):
     return ret_dict
 
 
-def parse_csvs_from_folder(folder_path):
+def list_files(folder_path, extension=None):
+    """
+    Helper function that lists the files of a folder in a deterministic order,
+    numbered files (1.feather, 2.feather, ...) are ordered by their number.
+    """
+
     files = os.listdir(folder_path)
+    if extension is not None:
+        files = [f for f in files if f.endswith(extension)]
+
+    return sorted(files, key=lambda f: (len(f), f))
+
+
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+
+def read_file(path, columns=None, filters=None, categorical=False, **kwargs):
+    """
+    Helper function that reads a csv, feather or parquet file into a dataframe
+    based on its extension. Only the given columns are read. For parquet files
+    the filters (e.g. [("value", ">", 0.8)]) are pushed down to the row groups,
+    and the categorical name columns are decoded to strings unless categorical
+    is set.
+    """
+
+    if path.endswith(".feather"):
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    elif path.endswith(".parquet"):
+        df = pd.read_parquet(path, columns=columns, filters=filters, **kwargs)
+        if not categorical:
+            for column in df.select_dtypes("category").columns:
+                df[column] = df[column].astype(df[column].cat.categories.dtype)
+        return df
+    else:
+        return pd.read_csv(path, usecols=columns, **kwargs)
+
+
+def write_file(df, path):
+    """
+    Helper function that writes a dataframe to a csv or parquet file based on
+    its extension. In parquet files the string columns with repeated values
+    (e.g. names in the edgelist) are stored as categoricals, mostly unique
+    columns are stored as plain strings as their dictionary would be as large
+    as the column. The other columns keep their types.
+    """
+
+    if path.endswith(".parquet"):
+        df = df.astype(
+            {
+                column: "category"
+                for column in df.select_dtypes(object).columns
+                if df[column].nunique() <= len(df) // 2
+            }
+        )
+        df.to_parquet(path, index=False, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    else:
+        df.to_csv(path, index=False)
 
-    df_list = []
-    for file in files:
-        fl = pd.read_csv(f"{folder_path}{file}")
-        df_list.append(fl)
+
+def read_files_parallel(paths, reader=read_file, max_workers=None, **kwargs):
+    """
+    Function that reads multiple files on a thread pool with at most max_workers
+    files decoded at the same time. The results are returned in the order of the
+    given paths. Keyword arguments (for example columns) are passed to the reader.
+    """
+
+    paths = list(paths)
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+    start_time = time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(partial(reader, **kwargs), paths))
+    elapsed = max(time() - start_time, 1e-9)
+
+    size_mb = sum(os.path.getsize(p) for p in paths) / 1024**2
+    logging.info(
+        f"{len(paths)} files ({size_mb:.1f} MB) read in {elapsed:.2f} seconds: "
+        f"{len(paths) / elapsed:.0f} files/s, {size_mb / elapsed:.1f} MB/s"
+    )
+
+    return results
+
+
+def parse_csvs_from_folder(folder_path, columns=None, filters=None, max_workers=None):
+    files = list_files(folder_path)
+
+    df_list = read_files_parallel(
+        [f"{folder_path}{file}" for file in files],
+        columns=columns,
+        max_workers=max_workers,
+        filters=filters,
+    )
 
     ret_df = pd.concat(df_list)
     ret_df.columns = ret_df.columns.str.lower()
     return ret_df
 
 
-def read_simulation_data(simulation_path, folder_name):
+def read_simulation_data(simulation_path, folder_name, columns=None, max_workers=None):
 
-    df_list = []
     path = f"{simulation_path}/{folder_name}"
-    for file in os.listdir(path):
-        df_list.append(pd.read_feather(f"{path}/{file}"))
+    df_list = read_files_parallel(
+        [f"{path}/{file}" for file in list_files(path, ".feather")],
+        columns=columns,
+        max_workers=max_workers,
+    )
 
     return df_list
 
 
-def parse_financials_from_folder(folder_path):
+FINANCIAL_COLUMNS = ["Total Assets", "Total Liabilities", "Total Equity"]
+FINANCIALS_DTYPES = {
+    "Identifier": str,
+    "Company Name": str,
+    "GICS Sector Name": str,
+    "GICS Industry Name": str,
+    **{column: "float64" for column in FINANCIAL_COLUMNS},
+}
+
+
+def read_financials_file(path):
     """
-    Function that parses together the data containing financial info and cleanes it.
-    NAs and wrong entries are removed, financial colums are converted to numeric type.
+    Helper function that reads one Refinitiv export (semicolon separated, decimal
+    comma, space as thousands separator) with explicit types and cleans it. NAs
+    and wrong entries are removed. If a financial column has malformed numbers
+    the file is read again with those columns as text and they are coerced.
     """
 
-    files = os.listdir(folder_path)
+    options = dict(sep=";", decimal=",", thousands=" ")
+    try:
+        fl = pd.read_csv(path, dtype=FINANCIALS_DTYPES, **options)
+    except ValueError:
+        logging.info(f"{path} has malformed numbers, they are coerced to NA")
+        fl = pd.read_csv(
+            path,
+            dtype={**FINANCIALS_DTYPES, **{c: str for c in FINANCIAL_COLUMNS}},
+            **options,
+        )
+        fl[FINANCIAL_COLUMNS] = fl[FINANCIAL_COLUMNS].apply(
+            lambda x: pd.to_numeric(
+                x.str.replace(",", ".", regex=False).str.replace(" ", "", regex=False),
+                errors="coerce",
+            )
+        )
 
-    df_list = []
-    for file in files:
-        fl = pd.read_csv(f"{folder_path}{file}", sep=";")
+    fl = fl.dropna()
+    fl = fl[(fl[FINANCIAL_COLUMNS] > 0).all(axis=1)]
+    fl.columns = fl.columns.str.replace(" ", "_").str.lower()
+    return fl
 
-        fl[["Total Assets", "Total Liabilities", "Total Equity"]] = fl[
-            ["Total Assets", "Total Liabilities", "Total Equity"]
-        ].apply(lambda x: x.str.replace(",", ".", regex=False))
 
-        fl[["Total Assets", "Total Liabilities", "Total Equity"]] = fl[
-            ["Total Assets", "Total Liabilities", "Total Equity"]
-        ].apply(lambda x: x.str.replace(" ", "", regex=False))
+def get_file_fingerprint(path):
+    """
+    Helper function that returns the fingerprint (size and modification time)
+    of a file, a changed fingerprint means that the file has to be read again.
+    """
 
-        fl[["Total Assets", "Total Liabilities", "Total Equity"]] = fl[
-            ["Total Assets", "Total Liabilities", "Total Equity"]
-        ].apply(lambda x: pd.to_numeric(x, errors="coerce"))
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
 
-        fl = fl.dropna()
 
-        fl = fl[
-            (fl["Total Equity"] > 0)
-            & (fl["Total Assets"] > 0)
-            & (fl["Total Liabilities"] > 0)
-        ]
-        fl.columns = fl.columns.str.replace(" ", "_")
-        df_list.append(fl)
+def read_financials_cache(cache_path):
+    """
+    Helper function that reads the cache of the cleaned financials, returns the
+    fingerprint and the data of every cached file. Files without valid rows are
+    cached as one empty row, they are returned as empty frames.
+    """
 
-    ret_df = pd.concat(df_list)
-    ret_df.columns = ret_df.columns.str.lower()
-    return ret_df
+    if cache_path is None or not os.path.exists(cache_path):
+        return {}
 
+    cache = read_file(cache_path)
+    return {
+        file: (fingerprint, fl.drop(columns=["source_file", "fingerprint"]).dropna())
+        for (file, fingerprint), fl in cache.groupby(
+            ["source_file", "fingerprint"], sort=False
+        )
+    }
 
-def chunks(lst, n):
-    """Yield successive n-sized chunks from lst."""
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
 
+def parse_financials_from_folder(folder_path, cache_path=None, max_workers=None):
+    """
+    Function that parses together the data containing financial info and cleanes it.
+    NAs and wrong entries are removed, financial colums are parsed as numbers while
+    reading. The files are read in parallel. If cache_path is given, the cleaned
+    data of every file is cached there with the fingerprint of the file, and only
+    new or changed files are read again.
+    """
 
-def parse_similarities_from_folder(folder_path):
-    files = os.listdir(folder_path)
+    files = list_files(folder_path)
+    fingerprints = {
+        file: get_file_fingerprint(f"{folder_path}{file}") for file in files
+    }
 
-    chunk_gen = chunks(files, 20)
-    df_list = []
-    for i, chunk in enumerate(chunk_gen):
-        for file in chunk:
-            fl = pd.read_csv(f"{folder_path}{file}")
-            df_list.append(fl[fl.value > 0.8])
-        logging.info(f"{i+1}. chunk read")
+    cache = read_financials_cache(cache_path)
+    frames = {
+        file: fl
+        for file, (fingerprint, fl) in cache.items()
+        if fingerprints.get(file) == fingerprint
+    }
+    to_read = [file for file in files if file not in frames]
+    if to_read:
+        parsed = read_files_parallel(
+            [f"{folder_path}{file}" for file in to_read],
+            reader=read_financials_file,
+            max_workers=max_workers,
+        )
+        frames.update(zip(to_read, parsed))
+    logging.info(
+        f"{len(files) - len(to_read)} financials files are read from cache, "
+        f"{len(to_read)} files are parsed"
+    )
+
+    ret_df = pd.concat([frames[file] for file in files], ignore_index=True)
+
+    # the cache is rewritten if a file is new, changed or removed, files without
+    # valid rows are recorded with one empty row so they are not read again
+    if cache_path is not None and (to_read or len(cache) != len(files)):
+        write_file(
+            pd.concat(
+                [
+                    (
+                        frames[file].reindex([0])
+                        if frames[file].empty
+                        else frames[file]
+                    ).assign(source_file=file, fingerprint=fingerprints[file])
+                    for file in files
+                ],
+                ignore_index=True,
+            ),
+            cache_path,
+        )
 
-    ret_df = pd.concat(df_list)
-    ret_df.columns = ret_df.columns.str.lower()
     return ret_df
+
+
+def map_bounded(executor, func, items, max_in_flight):
+    """
+    Generator that submits func(item) for every item to the executor while
+    keeping at most max_in_flight tasks pending, and yields the results in the
+    order of the items.
+    """
+
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def chunks(lst, n):
+    """Yield successive n-sized chunks from lst."""
+    for i in range(0, len(lst), n):
+        yield lst[i : i + n]
@@ -1,12 +1,20 @@
 import pandas as pd
 import logging
-from sec_edgar_downloader import Downloader
 import os
-from bs4 import BeautifulSoup
-import re
+import glob
+import json
+import queue
+import threading
+import time
+import requests
+from lxml import etree
 import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import deque
 from tqdm import tqdm
 
+from load.helpers import map_bounded, read_file, write_file
+
 
 logging.basicConfig(
     filename="logs/load_13f.log",
@@ -15,42 +23,244 @@ logging.basicConfig(
 )
 
 
-def download_13f_filings(submitters_path, data_folder, result_folder):
+EDGAR_SUBMISSIONS_URL = "https://data.sec.gov/submissions/"
+EDGAR_ARCHIVES_URL = "https://www.sec.gov/Archives/edgar/data/"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
     """
-    Downloader function that iterates through the companies that submitted the
-    13f form and downloads them into a given folder structure.
+    Thread-safe limiter that spaces the requests of all threads so that at most
+    requests_per_second requests are started in any second.
     """
 
-    submitters = get_submitters(submitters_path)
-    dl = Downloader(f"{data_folder}13f")
-    if os.path.exists(result_folder):
-        existing = os.listdir(result_folder)
-
-    for cik in submitters():
-        if os.path.exists(result_folder):
-            if cik not in existing:
-                download_13_filing_helper(cik, dl)
-            else:
-                logging.info(
-                    f"skipping download for {cik} as it has been already downloaded"
-                )
-        else:
-            download_13_filing_helper(cik, dl)
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
 
-    return 1
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(self.next_time, now)
+            self.next_time = start_time + self.interval
+        time.sleep(max(0, start_time - now))
+
+
+class EdgarClient:
+    """
+    Client for the EDGAR submissions api and archives that shares one rate
+    limiter between the download threads and retries the failed requests with
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        user_agent,
+        requests_per_second=10,
+        retries=5,
+        backoff=1.0,
+        submissions_url=EDGAR_SUBMISSIONS_URL,
+        archives_url=EDGAR_ARCHIVES_URL,
+    ):
+        self.headers = {"User-Agent": user_agent}
+        self.limiter = RateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+        self.submissions_url = submissions_url
+        self.archives_url = archives_url
+        self.local = threading.local()
+
+    def get(self, url):
+        """
+        Downloads the content of the url, returns None if it does not exist.
+        Connection errors and throttling or server errors are retried.
+        """
+
+        # sessions are not shared between the threads
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers)
+
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                response = self.local.session.get(url, timeout=30)
+                if response.status_code == 404:
+                    return None
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.content
+                error = f"status code {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                delay = self.backoff * 2**attempt
+                logging.debug(f"retrying {url} in {delay} seconds after {error}")
+                time.sleep(delay)
+
+        raise IOError(f"{url} failed after {self.retries + 1} attempts: {error}")
+
+    def get_latest_filing(self, cik, form="13F-HR"):
+        """Returns the accession number of the latest filing of the given form."""
+
+        content = self.get(f"{self.submissions_url}CIK{int(cik):010d}.json")
+        if content is None:
+            return None
+
+        recent = json.loads(content)["filings"]["recent"]
+        for accession, filing_form in zip(recent["accessionNumber"], recent["form"]):
+            if filing_form == form:
+                return accession
+
+    def get_full_submission(self, cik, accession):
+        """Returns the full submission txt of a filing."""
+
+        folder = accession.replace("-", "")
+        return self.get(f"{self.archives_url}{int(cik)}/{folder}/{accession}.txt")
+
+
+def download_13f_filing(cik, result_folder, client):
+    """
+    Function that downloads the latest 13f filing of a company to the
+    result_folder/cik/13F-HR/accession/full-submission.txt path. Returns the
+    status of the download and the path of the filing.
+    """
+
+    accession = client.get_latest_filing(cik)
+    if accession is None:
+        return "no_filing", None
+
+    content = client.get_full_submission(cik, accession)
+    if content is None:
+        return "no_filing", None
+
+    folder = f"{result_folder}{cik}/13F-HR/{accession}"
+    os.makedirs(folder, exist_ok=True)
+    path = f"{folder}/full-submission.txt"
+    # the file is renamed when it is complete, so a half written filing is never
+    # picked up by the parser or by a resumed run
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(content)
+    os.replace(f"{path}.tmp", path)
+
+    return "downloaded", path
 
 
-def download_13_filing_helper(cik, dl):
+def read_download_index(index_path):
+    """
+    Function that reads the ciks that are already processed (downloaded or
+    without 13f filing) from the download index.
+    """
+
+    if index_path is None or not os.path.exists(index_path):
+        return set()
+
+    return set(pd.read_csv(index_path, dtype={"cik": str}).cik)
+
+
+def iter_13f_downloads(
+    submitters_path,
+    result_folder,
+    user_agent,
+    index_path=None,
+    max_workers=8,
+    requests_per_second=10,
+    retries=5,
+    backoff=1.0,
+    submissions_url=EDGAR_SUBMISSIONS_URL,
+    archives_url=EDGAR_ARCHIVES_URL,
+):
+    """
+    Generator that downloads the latest 13f filing of every company that
+    submitted the 13f form into a given folder structure, and yields the path of
+    each filing as soon as it is on disk. The filings are downloaded on a thread
+    pool, the requests of all threads together are limited to
+    requests_per_second (EDGAR allows 10). The companies that are already in the
+    result folder or in the download index are skipped, every finished company
+    is appended to the index, so an interrupted download can be resumed.
+    """
+
+    submitters = get_submitters(submitters_path)
+    completed = read_download_index(index_path)
+    # companies with a complete filing in the result folder
+    completed |= {
+        path.split("/")[-4]
+        for path in glob.glob(f"{result_folder}*/13F-HR/*/full-submission.txt")
+    }
+
+    ciks = [cik for cik in submitters() if cik not in completed]
+    logging.info(
+        f"{len(ciks)} companies to download, {len(completed)} already completed"
+    )
+
+    client = EdgarClient(
+        user_agent,
+        requests_per_second=requests_per_second,
+        retries=retries,
+        backoff=backoff,
+        submissions_url=submissions_url,
+        archives_url=archives_url,
+    )
+
+    index_file = None
+    if index_path is not None:
+        write_header = not os.path.exists(index_path)
+        index_file = open(index_path, "a")
+        if write_header:
+            index_file.write("cik,status\n")
+
+    downloaded = 0
+    start_time = time.time()
     try:
-        res = dl.get("13F-HR", cik, amount=1)
-        if res == 1:
-            logging.info(f"Data downloaded for cik {cik}")
-        if res == 0:
-            logging.info(f"cannot find 13f filing for {cik}")
-    except Exception as e:
-        logging.warning(
-            f"when trying to download 13f filings for cik {cik} the following error occured: {e}"
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(download_13f_filing, cik, result_folder, client): cik
+                for cik in ciks
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                cik = futures[future]
+                try:
+                    status, path = future.result()
+                except Exception as e:
+                    logging.warning(
+                        f"when trying to download 13f filings for cik {cik} the following error occured: {e}"
+                    )
+                    continue
+
+                if index_file is not None:
+                    index_file.write(f"{cik},{status}\n")
+                    index_file.flush()
+                if status == "downloaded":
+                    downloaded += 1
+                    logging.info(f"Data downloaded for cik {cik}")
+                    yield path
+                else:
+                    logging.info(f"cannot find 13f filing for {cik}")
+    finally:
+        if index_file is not None:
+            index_file.close()
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    logging.info(
+        f"{downloaded} filings downloaded in {elapsed:.1f} seconds "
+        f"({len(ciks) / elapsed:.2f} companies/s)"
+    )
+
+
+def download_13f_filings(submitters_path, result_folder, user_agent, **kwargs):
+    """
+    Downloader function that downloads the latest 13f filing of every company
+    that submitted the 13f form into a given folder structure, see
+    iter_13f_downloads for the options. Returns the number of downloaded filings.
+    """
+
+    return sum(
+        1
+        for _ in iter_13f_downloads(
+            submitters_path, result_folder, user_agent, **kwargs
         )
+    )
 
 
 def get_submitters(submitter_path):
@@ -79,6 +289,91 @@ def get_path_for_txt(filings_folder, fold):
     return path
 
 
+SUBMISSION_TAGS = ["{*}periodOfReport", "{*}filingManager", "{*}infoTable"]
+
+
+class XMLSectionReader:
+    """
+    File-like helper that reads the next <XML> ... </XML> section of an open
+    submission txt, so that the section can be parsed as a standalone document.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.started = False
+        self.finished = False
+
+    def find_next_section(self):
+        """Moves the file position after the next <XML> line, False if none."""
+        for line in self.f:
+            if line.strip().upper() == b"<XML>":
+                self.started = False
+                self.finished = False
+                return True
+        return False
+
+    def read(self, size=-1):
+        chunks = []
+        length = 0
+        while not self.finished and (size < 0 or length < size):
+            line = self.f.readline()
+            if not line or line.strip().upper() == b"</XML>":
+                self.finished = True
+                break
+            # the xml declaration has to be at the very beginning of the document
+            if not self.started:
+                if not line.strip():
+                    continue
+                line = line.lstrip()
+                self.started = True
+            chunks.append(line)
+            length += len(line)
+
+        return b"".join(chunks)
+
+
+def iter_submission_xml(path, tags=SUBMISSION_TAGS):
+    """
+    Generator that streams the XML documents embedded in a 13f submission txt
+    (the primary document and the information table) with lxml's iterparse and
+    yields the elements with the given tags when their end tag is parsed.
+    """
+
+    with open(path, "rb") as f:
+        reader = XMLSectionReader(f)
+        while reader.find_next_section():
+            for _, element in etree.iterparse(
+                reader, events=("end",), tag=tags, huge_tree=True
+            ):
+                yield element
+
+
+def get_local_name(element):
+    """Helper function that returns the lowercase tag name without namespace."""
+    return etree.QName(element).localname.lower()
+
+
+def get_children_text(element):
+    """
+    Helper function that returns the text of the child elements in a dictionary
+    where the keys are the lowercase tag names without namespace.
+    """
+
+    return {
+        get_local_name(child): child.text
+        for child in element
+        if isinstance(child.tag, str)
+    }
+
+
+def clear_element(element):
+    """Helper function that frees an already processed element and its siblings."""
+
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
 def parse_filing(path):
 
     """
@@ -87,54 +382,59 @@ def parse_filing(path):
     of shares can be hold, to obtain the total ownership, the value of 3 stock
     is summarized. The returned df contains the name of the issuer of the stock
     and the value in 1000 USD.
+    The xml documents of the filing are streamed, every holding is processed
+    when it is parsed and freed afterwards, so large filings are not kept in
+    memory.
     """
 
-    soup = BeautifulSoup(open(path, encoding="utf8").read(), "lxml")
-
     try:
-        header = soup.find_all("headerdata")[0]
-        date_str = header.find("periodofreport").text
-        date = datetime.datetime.strptime(date_str, "%m-%d-%Y").date()
-
-        if date > datetime.date(2022, 6, 1):
-            # finding name if form filer company
-            formdata = soup.find_all("formdata")[0]
-            holder = formdata.find("filingmanager").find("name").text
-
-            infotables = soup.find_all(re.compile("infotable"))
-
-            records = []
-            for table in infotables:
-                # iterating through all companies that are held by the 13f reporter,
-                # saving important data, but dropping values if its an option
-                if not table.find(re.compile("putcall")):
-                    dic = {}
-                    dic["name_of_issuer"] = table.find(re.compile("nameofissuer")).text
-                    dic["title_of_class"] = table.find(re.compile("titleofclass")).text
-                    dic["cusip"] = table.find(re.compile("cusip")).text
-                    dic["value"] = int(
-                        table.find(re.compile("value")).text.replace(",", "")
+        date = None
+        holder = None
+        records = []
+        for element in iter_submission_xml(path):
+            tag = get_local_name(element)
+
+            if tag == "periodofreport" and date is None:
+                date = datetime.datetime.strptime(element.text, "%m-%d-%Y").date()
+
+                if date <= datetime.date(2022, 6, 1):
+                    logging.info(
+                        f"Filing in {path} contains older data then last quarter, information is ignored."
                     )
-                    records.append(dic)
+                    return None
+
+            elif tag == "filingmanager" and holder is None:
+                holder = get_children_text(element)["name"]
+
+            elif tag == "infotable":
+                # saving the companies that are held by the 13f reporter, but
+                # dropping values if its an option
+                fields = get_children_text(element)
+                if "putcall" not in fields:
+                    records.append(
+                        (
+                            fields["nameofissuer"],
+                            int(fields["value"].replace(",", "")),
+                        )
+                    )
+                clear_element(element)
 
-            df = pd.DataFrame(records)
+        if date is None or holder is None:
+            raise ValueError("period of report or filing manager is missing")
+        if not records:
+            raise ValueError("no holdings found in the information table")
 
-            # summarize ownership in 3 different share types to get full ownership
-            df = df.groupby("name_of_issuer")[["value"]].sum().reset_index()
-            df[["name_of_issuer"]] = df[["name_of_issuer"]].apply(
-                lambda x: x.str.lower()
-            )
+        df = pd.DataFrame(records, columns=["name_of_issuer", "value"])
 
-            # adding holder info to dataframe
-            df["holder"] = holder
-            logging.info(f"holdings parsed from file {path}")
+        # summarize ownership in 3 different share types to get full ownership
+        df = df.groupby("name_of_issuer")[["value"]].sum().reset_index()
+        df[["name_of_issuer"]] = df[["name_of_issuer"]].apply(lambda x: x.str.lower())
 
-            return df
+        # adding holder info to dataframe
+        df["holder"] = holder
+        logging.info(f"holdings parsed from file {path}")
 
-        else:
-            logging.info(
-                f"Filing in {path} contains older data then last quarter, information is ignored."
-            )
+        return df
 
     except Exception as e:
         logging.warning(
@@ -154,44 +454,422 @@ def create_edgelist_from_df(df):
     return edgelist
 
 
+def parse_filing_to_edgelist(path):
+    """
+    Worker function that parses one filing and returns its edgelist, or None if
+    the filing could not be parsed.
+    """
+
+    parsed_df = parse_filing(path)
+    if parsed_df is not None:
+        return create_edgelist_from_df(parsed_df)
+
+
+MANIFEST_COLUMNS = [
+    "path",
+    "accession",
+    "size",
+    "mtime_ns",
+    "status",
+    "shard",
+    "row_start",
+    "row_count",
+]
+
+
+def get_shard_path(edgelist_path, shard):
+    """Helper function that returns the path of an edgelist shard."""
+    return f"{edgelist_path}/{shard:05d}_chunk.parquet"
+
+
+def get_filing_record(path):
+    """
+    Helper function that returns the path, accession number, size and
+    modification time of a filing.
+    """
+
+    stat = os.stat(path)
+    return path, path.split("/")[-2], stat.st_size, stat.st_mtime_ns
+
+
+def write_edgelist_shard(edgelist_path, shard, edgelists, paths, entries):
+    """
+    Helper function that writes the edgelists of the given filings into one
+    shard and records the row range of each filing in its manifest entry.
+    """
+
+    write_file(pd.concat(edgelists), get_shard_path(edgelist_path, shard))
+    row_start = 0
+    for path, df in zip(paths, edgelists):
+        entries[path].update(shard=shard, row_start=row_start)
+        row_start += len(df)
+    logging.info(f"{shard}. chunk has been written to parquet.")
+
+
+def remove_filings_from_shards(edgelist_path, manifest, paths):
+    """
+    Helper function that removes the rows of the given filings from the shards
+    they were written to. The affected shards are rewritten with the rows of
+    their other filings (or deleted if nothing is left) and the manifest is
+    returned without the given filings and with the new row ranges.
+    """
+
+    removed = manifest.path.isin(paths)
+    old_shards = manifest.loc[removed, "shard"].dropna()
+    affected_shards = set(old_shards[old_shards >= 0].astype(int))
+    manifest = manifest[~removed].copy()
+
+    for shard in sorted(affected_shards):
+        shard_path = get_shard_path(edgelist_path, shard)
+        kept = manifest[manifest["shard"] == shard].sort_values("row_start")
+        if kept.empty or not os.path.exists(shard_path):
+            if os.path.exists(shard_path):
+                os.remove(shard_path)
+            continue
+
+        old_df = read_file(shard_path)
+        parts = []
+        row_start = 0
+        for row in kept.itertuples():
+            parts.append(
+                old_df.iloc[int(row.row_start) : int(row.row_start + row.row_count)]
+            )
+            manifest.loc[row.Index, "row_start"] = row_start
+            row_start += int(row.row_count)
+        write_file(pd.concat(parts), shard_path)
+        logging.info(f"{shard}. chunk has been rewritten without the replaced filings.")
+
+    return manifest
+
+
+def write_manifest(manifest, manifest_path, error_csv_path):
+    """
+    Helper function that writes the parse manifest and the paths of the filings
+    that failed to parse.
+    """
+
+    if manifest_path is not None:
+        manifest.to_csv(manifest_path, index=False)
+        logging.info(f"parse manifest is written to {manifest_path}")
+
+    failed_df = manifest.loc[manifest.status == "failed", ["path"]]
+    failed_df.to_csv(error_csv_path, index=False)
+    logging.info(f"paths that failed to parse are written to csv in {error_csv_path}")
+
+
+def list_filings(filings_folder):
+    """
+    Function that lists every 13f filing with its accession number, size and
+    modification time.
+    """
+
+    records = [
+        get_filing_record(get_path_for_txt(filings_folder, holder))
+        for holder in sorted(os.listdir(filings_folder))
+    ]
+
+    return pd.DataFrame(records, columns=MANIFEST_COLUMNS[:4])
+
+
+def read_manifest(manifest_path):
+    """
+    Function that reads the parse manifest, that records for every filing the
+    state of the file when it was parsed, whether the parsing succeeded, and the
+    shard and row range that holds its edgelist.
+    """
+
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+
+    return pd.read_csv(manifest_path, dtype={"accession": str})
+
+
 def parse_filings_to_edgelists(
-    filings_folder, error_csv_path, edgelist_path, chunksize
+    filings_folder,
+    error_csv_path,
+    edgelist_path,
+    chunksize,
+    processes=None,
+    max_in_flight=None,
+    manifest_path=None,
 ):
     """
     Function that lists all existing 13f reports and parses each of them into
     edgelists, then concatenates the edgelists together. The paths for files that
     are failed to parse are listed and saved to a csv file. The edgelists are
     written to files in chunks to avoid memory overload.
+    The filings are parsed on a process pool with at most max_in_flight filings
+    submitted at the same time, the results are collected in the order of the
+    filings, so the chunks are the same as in a sequential run.
+    If a manifest path is given, only the filings that are new or changed since
+    the last run (path, accession number, size or modification time differ) are
+    parsed. Changed and removed filings are replaced in the shard they were
+    written to, new filings are written to new shards, the other shards are left
+    untouched. The filings of a missing shard are parsed again, only the shards
+    recorded in the manifest are ever removed from the edgelist folder.
     """
 
-    fils = os.listdir(filings_folder)
+    filings = list_filings(filings_folder)
+    manifest = read_manifest(manifest_path)
+
+    merged = filings.merge(
+        manifest, on="path", how="left", suffixes=("", "_old"), validate="1:1"
+    )
+    unchanged = (
+        (merged["accession"] == merged["accession_old"])
+        & (merged["size"] == merged["size_old"])
+        & (merged["mtime_ns"] == merged["mtime_ns_old"])
+    )
+    # filings whose shard file is missing are parsed again
+    existing_shards = {
+        int(shard)
+        for shard in manifest["shard"].dropna().unique()
+        if shard >= 0 and os.path.exists(get_shard_path(edgelist_path, int(shard)))
+    }
+    missing_shard = (merged["shard"] >= 0) & ~merged["shard"].isin(existing_shards)
+    if missing_shard.any():
+        logging.warning(
+            f"{missing_shard.sum()} filings are parsed again because their chunk is missing"
+        )
+    unchanged &= ~missing_shard
+
+    removed = manifest[~manifest.path.isin(filings.path)]
+    to_parse = merged[~unchanged]
+    logging.info(
+        f"{len(to_parse)} new or changed filings to parse, {unchanged.sum()} unchanged "
+        f"and {len(removed)} removed filings"
+    )
+
+    # shards that have to be rewritten because of a changed or removed filing
+    old_shards = pd.concat([to_parse["shard"], removed["shard"]]).dropna()
+    affected_shards = set(old_shards[old_shards >= 0].astype(int))
+    next_shard = int(manifest["shard"].max()) + 1 if len(manifest) else 0
+
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or processes * 4
 
+    entries = {}
+    changed_edgelists = {}
     edgelists = []
-    failed_paths = []
-    for i, holder in enumerate(tqdm(fils)):
-        # get path, name for each 13f reporter company
-        path = get_path_for_txt(filings_folder, holder)
-
-        # parse the txt filing dataframe, if succeeds, parse it to edgelist
-        parsed_df = parse_filing(path)
-
-        if parsed_df is not None:
-            edgelists.append(create_edgelist_from_df(parsed_df))
-        else:
-            logging.info(f"Could not parse holdings data for {path}")
-            failed_paths.append(path)
-
-        # writing the concatenated edgelists to files after a given chunksize to
-        # avoid memory overload
-        if ((i + 1) % chunksize == 0) or ((i + 1) == len(fils)):
-            edgelist = pd.concat(edgelists)
-            edgelists = []
-            logging.info(f"{(i+1)/chunksize}. chunk has been written to csv.")
-            edgelist.to_csv(f"{edgelist_path}/{(i+1)/chunksize}_chunk.csv", index=False)
-
-    failed_df = pd.DataFrame(failed_paths, columns=["path"])
-    failed_df.to_csv(error_csv_path, index=False)
-    logging.info(f"paths that failed to parse are written to csv in {error_csv_path}")
+    new_paths = []
+
+    def write_new_shard():
+        nonlocal next_shard, edgelists, new_paths
+        write_edgelist_shard(edgelist_path, next_shard, edgelists, new_paths, entries)
+        next_shard += 1
+        edgelists, new_paths = [], []
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = map_bounded(
+            executor, parse_filing_to_edgelist, to_parse.path, max_in_flight
+        )
+        for row, edgelist in tqdm(
+            zip(to_parse.itertuples(), results), total=len(to_parse)
+        ):
+            entry = dict(
+                status="parsed",
+                shard=-1,
+                row_start=0,
+                row_count=0 if edgelist is None else len(edgelist),
+            )
+            entries[row.path] = entry
+
+            if edgelist is None:
+                logging.info(f"Could not parse holdings data for {row.path}")
+                entry["status"] = "failed"
+            elif not pd.isna(row.shard) and row.shard >= 0:
+                # changed filings are written back to their own shard
+                entry["shard"] = int(row.shard)
+                changed_edgelists[row.path] = edgelist
+            else:
+                edgelists.append(edgelist)
+                new_paths.append(row.path)
+
+            # writing the concatenated edgelists to files after a given chunksize to
+            # avoid memory overload
+            if len(edgelists) == chunksize:
+                write_new_shard()
+
+        if edgelists:
+            write_new_shard()
+
+    # the unchanged filings keep their manifest entries
+    for row in merged[unchanged].itertuples():
+        entries[row.path] = dict(
+            status=row.status,
+            shard=int(row.shard),
+            row_start=int(row.row_start),
+            row_count=int(row.row_count),
+        )
+
+    # rewriting the shards that contain changed or removed filings
+    for shard in sorted(affected_shards):
+        shard_path = get_shard_path(edgelist_path, shard)
+        old_df = read_file(shard_path) if os.path.exists(shard_path) else None
+
+        parts = []
+        row_start = 0
+        for path in filings.path:
+            entry = entries[path]
+            if entry["shard"] != shard:
+                continue
+            if path in changed_edgelists:
+                part = changed_edgelists[path]
+            else:
+                part = old_df.iloc[
+                    entry["row_start"] : entry["row_start"] + entry["row_count"]
+                ]
+            entry["row_start"] = row_start
+            row_start += len(part)
+            parts.append(part)
+
+        if parts:
+            write_file(pd.concat(parts), shard_path)
+            logging.info(f"{shard}. chunk has been rewritten.")
+        elif os.path.exists(shard_path):
+            os.remove(shard_path)
+
+    # removing the chunks of the previous manifest that are not part of the
+    # current output, other files in the folder are left untouched
+    shards = {e["shard"] for e in entries.values() if e["shard"] >= 0}
+    for shard in sorted(existing_shards - shards):
+        shard_path = get_shard_path(edgelist_path, shard)
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+            logging.info(f"stale chunk {shard_path} is removed")
+
+    new_manifest = filings.copy()
+    for column in MANIFEST_COLUMNS[4:]:
+        new_manifest[column] = [entries[path][column] for path in filings.path]
+    write_manifest(new_manifest, manifest_path, error_csv_path)
     logging.debug("A run has been finished.")
 
     return 1
+
+
+def download_and_parse_filings(
+    submitters_path,
+    result_folder,
+    error_csv_path,
+    edgelist_path,
+    chunksize,
+    user_agent,
+    index_path=None,
+    manifest_path=None,
+    processes=None,
+    max_in_flight=None,
+    **download_options,
+):
+    """
+    Function that downloads the 13f filings and parses them at the same time.
+    The downloader thread puts every filing into a bounded queue as soon as it
+    is on disk, the filings are parsed from the queue on a process pool and the
+    edgelists are written to new shards in the order the filings arrive, so the
+    ingest takes about as long as the slower of the download and the parsing.
+    The parsed filings are added to the parse manifest, so a later
+    parse_filings_to_edgelists run with the same manifest does not parse them
+    again, filings that were already in the manifest are removed from their old
+    shards. If the parsing fails, the downloader is stopped. Returns the number
+    of parsed filings.
+    """
+
+    manifest = read_manifest(manifest_path)
+    next_shard = int(manifest["shard"].max()) + 1 if len(manifest) else 0
+
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or processes * 4
+    filings_queue = queue.Queue(maxsize=max_in_flight)
+    download_errors = []
+    stop = threading.Event()
+
+    def put(item):
+        # waiting for free space in the queue until the consumer stops
+        while not stop.is_set():
+            try:
+                filings_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def download():
+        try:
+            for path in iter_13f_downloads(
+                submitters_path,
+                result_folder,
+                user_agent,
+                index_path=index_path,
+                **download_options,
+            ):
+                if not put(path):
+                    return
+        except Exception as e:
+            download_errors.append(e)
+        finally:
+            put(None)
+
+    # the paths of the filings submitted for parsing, in the order of the results
+    submitted_paths = deque()
+
+    def iter_queue():
+        for path in iter(filings_queue.get, None):
+            submitted_paths.append(path)
+            yield path
+
+    downloader = threading.Thread(target=download, daemon=True)
+    downloader.start()
+
+    entries = {}
+    edgelists = []
+    new_paths = []
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = map_bounded(
+                executor, parse_filing_to_edgelist, iter_queue(), max_in_flight
+            )
+            for edgelist in results:
+                path = submitted_paths.popleft()
+                entries[path] = dict(
+                    status="parsed",
+                    shard=-1,
+                    row_start=0,
+                    row_count=0 if edgelist is None else len(edgelist),
+                )
+
+                if edgelist is None:
+                    logging.info(f"Could not parse holdings data for {path}")
+                    entries[path]["status"] = "failed"
+                else:
+                    edgelists.append(edgelist)
+                    new_paths.append(path)
+
+                if len(edgelists) == chunksize:
+                    write_edgelist_shard(
+                        edgelist_path, next_shard, edgelists, new_paths, entries
+                    )
+                    next_shard += 1
+                    edgelists, new_paths = [], []
+
+            if edgelists:
+                write_edgelist_shard(
+                    edgelist_path, next_shard, edgelists, new_paths, entries
+                )
+    finally:
+        stop.set()
+
+    downloader.join()
+    if download_errors:
+        raise download_errors[0]
+
+    parsed = pd.DataFrame(
+        [get_filing_record(path) for path in entries], columns=MANIFEST_COLUMNS[:4]
+    )
+    for column in MANIFEST_COLUMNS[4:]:
+        parsed[column] = [entries[path][column] for path in parsed.path]
+    manifest = remove_filings_from_shards(edgelist_path, manifest, parsed.path)
+    new_manifest = pd.concat([manifest, parsed]).sort_values("path")
+
+    write_manifest(new_manifest, manifest_path, error_csv_path)
+    logging.debug(f"A pipelined run has been finished, {len(entries)} filings parsed.")
+
+    return len(entries)
@@ -1,8 +1,24 @@
+import os
+import re
+import hashlib
 import pandas as pd
+import numpy as np
 import jellyfish
 import itertools
 import logging
-from load.helpers import parse_csvs_from_folder, parse_financials_from_folder, chunks
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import time
+from scipy import sparse
+from load.helpers import (
+    parse_csvs_from_folder,
+    parse_financials_from_folder,
+    chunks,
+    map_bounded,
+    read_file,
+    write_file,
+)
 
 logging.basicConfig(
     filename="logs/load.log",
@@ -11,17 +27,16 @@ logging.basicConfig(
 )
 
 
+SIMILARITY_TASK_SIZE = 50_000
+
+
 def standardize_tickers(column):
     return column.apply(lambda x: x.split(".")[0])
 
 
-def standardize_names(column):
-    """
-    Function that standardizes the names of the companies in to prepare them
-    for string distance calculation.
-    """
-
-    corp_name_list = [
+CORP_NAME_PATTERNS = [
+    re.compile(pattern)
+    for pattern in [
         r"\binc\b",
         "inc$",
         "company",
@@ -66,91 +81,249 @@ def standardize_names(column):
         "series a",
         "series b",
         "pharma",
-        "\(.*?\)",
+        r"\(.*?\)",
     ]
-    spec_char_dict = {",": "", ".": " ", "&": " ", "/": "", "-": ""}
+]
+SPEC_CHAR_TABLE = str.maketrans({",": "", ".": " ", "&": " ", "/": "", "-": ""})
+
+
+def get_standardization_rules_hash():
+    """
+    Helper function that returns the hash of the standardization rules, the
+    memo of standardized names is only valid for the same rules.
+    """
+
+    rules = [pattern.pattern for pattern in CORP_NAME_PATTERNS]
+    rules.append(str(sorted(SPEC_CHAR_TABLE.items())))
+    return hashlib.sha256("\n".join(rules).encode()).hexdigest()[:16]
 
-    column = column.astype(str)
-    ret_col = column.apply(lambda x: x.lower())
-    for char, value in spec_char_dict.items():
-        ret_col = ret_col.str.replace(char, value, regex=False)
 
-    for name in corp_name_list:
-        ret_col = ret_col.str.replace(name, "", regex=True)
+def standardize_name(name):
+    """
+    Function that standardizes one company name: lowercase, special characters
+    removed, the corporate words removed in order, words joined with "_".
+    """
+
+    name = name.lower().translate(SPEC_CHAR_TABLE)
+    for pattern in CORP_NAME_PATTERNS:
+        name = pattern.sub("", name)
+
+    return "_".join(name.split())
 
-    ret_col = ret_col.apply(lambda x: x.strip())
-    ret_col = ret_col.apply(lambda x: "_".join(x.split()))
 
-    return ret_col
+def read_name_memo(memo_path):
+    """
+    Function that reads the memo of the standardized names, an empty memo is
+    returned if it does not exist or was created with different rules.
+    """
+
+    if memo_path is None or not os.path.exists(memo_path):
+        return {}
+
+    memo = read_file(memo_path)
+    if not (memo.rules == get_standardization_rules_hash()).all():
+        logging.info("standardization rules changed, the name memo is rebuilt")
+        return {}
+
+    return dict(zip(memo.name, memo.standardized))
+
+
+def write_name_memo(memo, memo_path):
+    """Function that writes the memo of the standardized names."""
+
+    write_file(
+        pd.DataFrame(
+            {
+                "name": list(memo.keys()),
+                "standardized": list(memo.values()),
+                "rules": get_standardization_rules_hash(),
+            }
+        ),
+        memo_path,
+    )
+
+
+def standardize_names(column, memo=None):
+    """
+    Function that standardizes the names of the companies in to prepare them
+    for string distance calculation. Every unique name is standardized once and
+    the result is mapped back to the rows. If a memo (name: standardized name,
+    see read_name_memo) is given, the known names are taken from it and the new
+    ones are added to it, so that it can be shared between calls and saved once.
+    """
+
+    column = column.astype(str)
+    codes, uniques = pd.factorize(column)
+
+    if memo is None:
+        memo = {}
+    new_names = [name for name in uniques if name not in memo]
+    for name in new_names:
+        memo[name] = standardize_name(name)
+    logging.debug(
+        f"{len(uniques)} unique names in {len(column)} rows, "
+        f"{len(new_names)} names standardized"
+    )
+
+    # missing values have code -1, they are mapped to the last element
+    standardized = np.array([memo[name] for name in uniques] + [np.nan], dtype=object)
+    return pd.Series(standardized[codes], index=column.index, name=column.name)
 
 
 def create_standardized_edgelist_node_list(
-    financials_folder, edgelist_folder, node_temp_path, edgelist_temp_path
+    financials_folder,
+    edgelist_folder,
+    node_temp_path,
+    edgelist_temp_path,
+    memo_path=None,
+    financials_cache_path=None,
 ):
     """
     Function that joins the chunks for the nodes and edges and standardizes their
-    names, then writes them to a temporary folder.
+    names, then writes them to a temporary folder. The standardized names are
+    memoized at memo_path, the memo is read once and written once if new names
+    were standardized. The cleaned financials are cached at
+    financials_cache_path if given.
     """
 
     edgelist = parse_csvs_from_folder(edgelist_folder)
-    financials = parse_financials_from_folder(financials_folder)
+    financials = parse_financials_from_folder(financials_folder, financials_cache_path)
     logging.info("financials data and edgelist chunks are read.")
 
-    financials["company_name"] = standardize_names(financials["company_name"])
+    memo = read_name_memo(memo_path)
+    memo_size = len(memo)
+    financials["company_name"] = standardize_names(financials["company_name"], memo)
     financials["identifier"] = standardize_tickers(financials["identifier"])
-    edgelist["source"] = standardize_names(edgelist["source"])
-    edgelist["target"] = standardize_names(edgelist["target"])
+    edgelist["source"] = standardize_names(edgelist["source"], memo)
+    edgelist["target"] = standardize_names(edgelist["target"], memo)
+    if memo_path is not None and len(memo) > memo_size:
+        write_name_memo(memo, memo_path)
     logging.info("name standardization finished.")
 
-    financials.to_csv(node_temp_path, index=False)
-    edgelist.to_csv(edgelist_temp_path, index=False)
+    write_file(financials, node_temp_path)
+    write_file(edgelist, edgelist_temp_path)
     logging.info("Standardized egdelist and node info is written to working directory.")
 
     return 1
 
 
-def create_similarity_csv(node_temp_path, edgelist_temp_path, sim_path):
+def create_similarity_file(
+    node_temp_path,
+    edgelist_temp_path,
+    sim_path,
+    threshold=None,
+    top_k=None,
+    blocking=True,
+    recall_sample=200,
+    processes=None,
+    max_in_flight=None,
+):
     """
-    Function that calculates the Jaro-Winkler similarity for each possible
-    combinations of the names in two different sources, then writes the similarity
-    dataframe to a csv file.
+    Function that calculates the Jaro-Winkler similarity for the names in two
+    different sources and writes the matching pairs to one file at sim_path.
+    With blocking only the candidate pairs that share a prefix or enough
+    character n-grams are scored, otherwise every possible combination. The
+    pairs are scored on a process pool and only the pairs with similarity at
+    least threshold, and at most top_k companies for each target, are kept. If
+    a threshold is given, the recall of the blocking at the threshold is
+    measured on a sample of the names and logged.
     """
 
-    financials = pd.read_csv(node_temp_path)
-    edgelist = pd.read_csv(edgelist_temp_path)
+    start_time = time()
+    financials = read_file(node_temp_path, columns=["company_name"])
+    edgelist = read_file(edgelist_temp_path, columns=["target"])
 
     # getting unique values for sources in edgelist
     unique_target = edgelist.groupby("target").count().reset_index()[["target"]]
 
-    chunk_gen = chunks(financials.company_name, 50)
-    for i, chunk in enumerate(chunk_gen):
-        sim_df = calculate_similarity_df(chunk, unique_target.target)
-        sim_df.to_csv(f"{sim_path}{i+1}_chunk.csv", index=False)
-        logging.info(
-            f"similarity measures are calculated for {i+1}. chunk, data is written to {sim_path}{i}_chunk.csv"
+    if blocking and threshold is not None:
+        measure_blocking_recall(
+            financials.company_name.drop_duplicates(),
+            unique_target.target,
+            threshold,
+            sample_size=recall_sample,
+        )
+
+    if blocking:
+        target_index = create_ngram_index(unique_target.target)
+        score = partial(
+            calculate_similarity_df, None, None, threshold=threshold, top_k=top_k
+        )
+
+        def iter_tasks():
+            company_names = financials.company_name.drop_duplicates()
+            for chunk in chunks(company_names, 1000):
+                candidates = generate_candidate_pairs(chunk, target_index)
+                for i in range(0, len(candidates), SIMILARITY_TASK_SIZE):
+                    yield candidates.iloc[i : i + SIMILARITY_TASK_SIZE]
+
+    else:
+        score = partial(
+            calculate_similarity_df,
+            column2=unique_target.target,
+            threshold=threshold,
+            top_k=top_k,
         )
 
+        def iter_tasks():
+            yield from chunks(financials.company_name, 50)
+
+    sim_df = score_in_parallel(score, iter_tasks(), processes, max_in_flight)
+    if top_k is not None:
+        sim_df = select_top_k(sim_df, top_k)
+
+    write_file(sim_df, sim_path)
+    logging.info(
+        f"{len(sim_df)} similar pairs are calculated in {time() - start_time:.1f} "
+        f"seconds, data is written to {sim_path}"
+    )
+
     return 1
 
 
+def create_similarity_csv(*args, **kwargs):
+    """
+    Deprecated alias of create_similarity_file, the similarities are written
+    to parquet since the scoring runs on a process pool.
+    """
+
+    warnings.warn(
+        "create_similarity_csv is deprecated, use create_similarity_file instead",
+        DeprecationWarning,
+        stacklevel=2,
+    )
+    return create_similarity_file(*args, **kwargs)
+
+
 def create_node_info_and_filtered_edgelist(
-    sim_path, threshold, node_temp_path, node_path, edgelist_temp_path, edgelist_path
+    sim_path,
+    threshold,
+    node_temp_path,
+    node_path,
+    edgelist_temp_path,
+    edgelist_path,
+    audit_path=None,
+    wrong_nodes=None,
 ):
     """
     Function that takes the temporary edgelist and node list and similarity
     file as input, filters the similarity file based on a threshold,
-    changes the names in the edgelists and filters both edgelist and node list
-    to contain only data from the US market that are in both files.
+    changes the names in the edgelists, converts the values of the wrong nodes
+    (filers reporting in dollars) to thousands and filters both edgelist and
+    node list to contain only data from the US market that are in both files.
+    The changed rows of the edgelist are written to audit_path if given.
     """
 
-    sim_df = pd.read_csv(sim_path)
-    financials = pd.read_csv(node_temp_path)
-    edgelist = pd.read_csv(edgelist_temp_path)
+    sim_df = read_file(sim_path, filters=[("value", ">=", threshold)])
+    financials = read_file(node_temp_path)
+    edgelist = read_file(edgelist_temp_path)
 
     filt_sim = sim_df[sim_df.value >= threshold]
 
-    edgelist = replace_names_in_edgelist(edgelist, filt_sim)
-    logging.info("names are substituted in the edgelist")
+    edgelist, _ = normalize_edgelist(
+        edgelist, wrong_nodes=wrong_nodes, map_df=filt_sim, audit_path=audit_path
+    )
+    logging.info("names are substituted and values are updated in the edgelist")
 
     # getting unique values for targets in new edgelist
     unique_target = edgelist.groupby("target").count().reset_index()[["target"]]
@@ -178,55 +351,275 @@ def create_node_info_and_filtered_edgelist(
 
     # removing duplicate nodes from node list
     node_data = node_data[~node_data.duplicated("name")]
-    node_data.to_csv(node_path, index=False)
-    logging.info(f"node info csv is written to file at {node_path}")
+    write_file(node_data, node_path)
+    logging.info(f"node info is written to file at {node_path}")
 
     edgelist_filt = edgelist[edgelist.target.isin(node_data.name)]
     # removing duplicate edges with summarizing the weight on them
     edgelist_filt = edgelist_filt.groupby(["source", "target"]).sum().reset_index()
-    edgelist_filt.to_csv(edgelist_path, index=False)
+    write_file(edgelist_filt, edgelist_path)
     logging.info(f"filtered final edgelist is written to file at {edgelist_path}")
 
     return 1
 
 
-def calculate_similarity_df(column1, column2):
+def calculate_similarity_df(
+    column1, column2, candidates=None, threshold=None, top_k=None
+):
     """
     Function that calculates the string similarity between the two names.
-    Returns a dataframe with similarity measures.
+    Returns a dataframe with similarity measures. If a dataframe of candidate
+    pairs (company_name, target) is given, only those pairs are compared instead
+    of every combination of the two columns. Only the pairs with similarity at
+    least threshold, and the top_k most similar companies for each target are
+    kept, if given.
     """
 
-    combinations = itertools.product(column1, column2)
+    if candidates is None:
+        combinations = itertools.product(column1, column2)
+    else:
+        combinations = zip(candidates.company_name, candidates.target)
 
     name_list = []
     for com in combinations:
         try:
-            name_list.append(
-                [com[0], com[1], jellyfish.jaro_winkler_similarity(com[0], com[1])]
-            )
+            value = jellyfish.jaro_winkler_similarity(com[0], com[1])
+            if threshold is None or value >= threshold:
+                name_list.append([com[0], com[1], value])
         except Exception as e:
             logging.warning(
                 f"could not calculate similarity measure for {com[0]}, {com[1]} because the following error occured: {e}"
             )
 
     sim_df = pd.DataFrame(name_list, columns=["company_name", "target", "value"])
+    if top_k is not None:
+        sim_df = select_top_k(sim_df, top_k)
+
     return sim_df
 
 
-def replace_names_in_edgelist(edgelist, map_df):
+def score_in_parallel(score, tasks, processes=None, max_in_flight=None):
     """
-    Function to replace names with their similar mapping in the edgelist.
+    Function that runs the similarity scoring function on every task (a chunk
+    of names or of candidate pairs) on a process pool with at most
+    max_in_flight tasks pending, and concatenates the resulting dataframes.
+    """
+
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or processes * 4
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        df_list = list(map_bounded(executor, score, tasks, max_in_flight))
+
+    if not df_list:
+        return pd.DataFrame(columns=["company_name", "target", "value"])
+
+    return pd.concat(df_list, ignore_index=True)
+
+
+def select_top_k(sim_df, top_k):
+    """
+    Helper function that keeps the top_k most similar companies for each target
+    in a similarity dataframe.
+    """
+
+    return (
+        sim_df.sort_values(["value", "company_name"], ascending=[False, True])
+        .groupby("target", sort=False)
+        .head(top_k)
+        .reset_index(drop=True)
+    )
+
+
+def get_ngrams(name, n=3):
+    """
+    Helper function that returns the set of character n-grams of a name, the
+    name is padded so that its beginning and end also form n-grams.
     """
 
-    map_dict = dict(zip(map_df.target, map_df.company_name))
-    edgelist.loc[edgelist.source.isin(map_dict.keys()), "source"] = edgelist[
-        edgelist.source.isin(map_dict.keys())
-    ]["source"].map(map_dict, na_action="ignore")
+    padded = f"#{name}#"
+    return {padded[i : i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def create_ngram_matrix(names, vocabulary, n=3, extend=False):
+    """
+    Helper function that returns a binary sparse matrix of the names and their
+    n-grams in the vocabulary, and the number of n-grams of each name. If extend
+    is set, the new n-grams are added to the vocabulary, otherwise skipped.
+    """
+
+    rows, cols, sizes = [], [], []
+    for i, name in enumerate(names):
+        ngrams = get_ngrams(name, n)
+        sizes.append(len(ngrams))
+        for ngram in ngrams:
+            if extend:
+                vocabulary.setdefault(ngram, len(vocabulary))
+            if ngram in vocabulary:
+                rows.append(i)
+                cols.append(vocabulary[ngram])
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(names), len(vocabulary)),
+    )
+
+    return matrix, np.array(sizes, dtype=np.int64)
+
+
+def create_ngram_index(names, n=3, prefix_length=3):
+    """
+    Function that creates a blocking index for a list of names: the n-gram
+    vocabulary, a sparse matrix of the names and their n-grams, the number of
+    n-grams of each name and the positions of the names grouped by their prefix.
+    """
+
+    names = pd.Series(names).reset_index(drop=True)
+    vocabulary = {}
+    matrix, sizes = create_ngram_matrix(names, vocabulary, n, extend=True)
+    prefixes = names.str[:prefix_length]
+
+    return {
+        "names": names,
+        "n": n,
+        "prefix_length": prefix_length,
+        "vocabulary": vocabulary,
+        "matrix": matrix,
+        "sizes": sizes,
+        "prefixes": prefixes.groupby(prefixes).groups,
+    }
 
-    edgelist.loc[edgelist.target.isin(map_dict.keys()), "target"] = edgelist[
-        edgelist.target.isin(map_dict.keys())
-    ]["target"].map(map_dict, na_action="ignore")
 
+def generate_candidate_pairs(names, index, min_overlap=0.5):
+    """
+    Function that generates the plausible matching pairs between the names and
+    the names of an n-gram index. A pair is a candidate if the names share their
+    prefix (Jaro-Winkler rewards common prefixes), or if the share of common
+    n-grams in the name with fewer n-grams is at least min_overlap. Returns a
+    dataframe of the candidate pairs (company_name, target).
+    """
+
+    names = pd.Series(names).reset_index(drop=True)
+    matrix, sizes = create_ngram_matrix(names, index["vocabulary"], index["n"])
+
+    # number of common n-grams of every pair that has at least one
+    shared = (matrix @ index["matrix"].T).tocoo()
+    overlap = shared.data / np.minimum(sizes[shared.row], index["sizes"][shared.col])
+    keep = overlap >= min_overlap
+    pairs = set(zip(shared.row[keep].tolist(), shared.col[keep].tolist()))
+
+    # pairs with a common prefix
+    prefixes = index["prefixes"]
+    for i, prefix in enumerate(names.str[: index["prefix_length"]]):
+        pairs.update((i, j) for j in prefixes.get(prefix, []))
+
+    pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+    return pd.DataFrame(
+        {
+            "company_name": names.values[pairs[:, 0]],
+            "target": index["names"].values[pairs[:, 1]],
+        }
+    )
+
+
+def measure_blocking_recall(
+    names1,
+    names2,
+    threshold,
+    sample_size=200,
+    seed=0,
+    n=3,
+    prefix_length=3,
+    min_overlap=0.5,
+):
+    """
+    Function that measures the recall of the candidate pair generation against
+    the brute force comparison on a sample of the first names: the share of the
+    pairs with similarity at least threshold that are among the candidates.
+    Returns the recall and the share of the pairs that are compared.
+    """
+
+    names1 = pd.Series(names1)
+    if sample_size is not None and sample_size < len(names1):
+        names1 = names1.sample(sample_size, random_state=seed)
+
+    brute_force = calculate_similarity_df(names1, names2)
+    matches = brute_force[brute_force.value >= threshold]
+    matches = set(zip(matches.company_name, matches.target))
+
+    index = create_ngram_index(names2, n, prefix_length)
+    candidates = generate_candidate_pairs(names1, index, min_overlap)
+    found = matches & set(zip(candidates.company_name, candidates.target))
+
+    recall = len(found) / len(matches) if matches else 1.0
+    comparisons = len(candidates) / max(len(brute_force), 1)
+    logging.info(
+        f"blocking recall at threshold {threshold}: {recall:.4f} ({len(found)} of "
+        f"{len(matches)} matches), {comparisons:.2%} of the pairs are compared"
+    )
+
+    return recall, comparisons
+
+
+def normalize_edgelist(edgelist, wrong_nodes=None, map_df=None, audit_path=None):
+    """
+    Function that normalizes the edgelist in vectorized passes: the names in
+    the source and target columns are replaced with their mapping in map_df
+    (target -> company_name) by recoding the unique names, then the values of
+    the sources in wrong_nodes are divided by 1000 (they were not reported in
+    thousands in the filing). Returns the edgelist and the rows that changed,
+    with their original and new values. The changes are written to audit_path
+    if given.
+    """
+
+    changed = np.zeros(len(edgelist), dtype=bool)
+    new_columns = {}
+    # unique names of each column and the codes of the rows, missing names have
+    # code -1 so they are mapped to the appended last element
+    recoded = {}
+    for column in ["source", "target"]:
+        codes, uniques = pd.factorize(edgelist[column])
+        recoded[column] = (codes, np.append(np.asarray(uniques, dtype=object), np.nan))
+
+    if map_df is not None:
+        map_dict = dict(zip(map_df.target, map_df.company_name))
+        for column, (codes, uniques) in recoded.items():
+            mapped = np.array(
+                [map_dict.get(name, name) for name in uniques], dtype=object
+            )
+            renamed = (mapped != uniques) & pd.notna(uniques)
+            if renamed.any():
+                new_columns[column] = pd.Series(mapped[codes], index=edgelist.index)
+                changed |= renamed[codes]
+                recoded[column] = (codes, mapped)
+
+    if wrong_nodes is not None and len(wrong_nodes):
+        # the wrong nodes are given with their final (renamed) names
+        codes, uniques = recoded["source"]
+        scaled = np.isin(uniques, list(wrong_nodes))[codes]
+        if scaled.any():
+            new_columns["value"] = edgelist.value / np.where(scaled, 1000.0, 1.0)
+            changed |= scaled
+
+    changes = edgelist.loc[changed, ["source", "target", "value"]].copy()
+    for column in ["source", "target", "value"]:
+        values = new_columns.get(column, edgelist[column])
+        changes[f"new_{column}"] = values[changed].values
+        edgelist[column] = values
+    changes.index.name = "row"
+
+    if audit_path is not None:
+        write_file(changes.reset_index(), audit_path)
+    logging.info(f"{changed.sum()} rows of the edgelist are changed in normalization")
+
+    return edgelist, changes
+
+
+def replace_names_in_edgelist(edgelist, map_df):
+    """
+    Function to replace names with their similar mapping in the edgelist.
+    """
+
+    edgelist, _ = normalize_edgelist(edgelist, map_df=map_df)
     return edgelist
 
 
@@ -237,8 +630,5 @@ def update_values_in_edgelist(edgelist, nodes):
     the updated edgelist as a dataframe.
     """
 
-    for node in nodes:
-        edgelist.loc[edgelist.source == node, "value"] = (
-            edgelist[edgelist.source == node].value / 1000
-        )
+    edgelist, _ = normalize_edgelist(edgelist, wrong_nodes=nodes)
     return edgelist
@@ -0,0 +1,291 @@
+import os
+import pickle
+import logging
+import pandas as pd
+from functools import partial
+from time import time
+from load.helpers import chunks, read_file, write_file
+from load.manipulations import (
+    SIMILARITY_TASK_SIZE,
+    calculate_similarity_df,
+    create_ngram_index,
+    generate_candidate_pairs,
+    score_in_parallel,
+    select_top_k,
+)
+
+logging.basicConfig(
+    filename="logs/load.log",
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+COMPANY_COLUMNS = ["company_id", "company_name"]
+MATCH_COLUMNS = ["target", "company_id", "company_name", "value"]
+OVERRIDE_COLUMNS = ["target", "company_name"]
+WRONG_NODE_COLUMNS = ["source"]
+
+
+def load_entity_index(index_path):
+    """
+    Function that loads the entity resolution index from its folder: the known
+    companies, the best scored match of every 13f name seen so far, the manual
+    overrides, the 13f filers that report their holdings in dollars instead of
+    thousands (wrong nodes) and the n-gram index of the companies. Missing
+    parts are empty.
+    """
+
+    def read_or_empty(name, columns):
+        path = f"{index_path}{name}"
+        return (
+            read_file(path) if os.path.exists(path) else pd.DataFrame(columns=columns)
+        )
+
+    ngram_index = None
+    if os.path.exists(f"{index_path}ngram_index.pkl"):
+        with open(f"{index_path}ngram_index.pkl", "rb") as f:
+            ngram_index = pickle.load(f)
+
+    return {
+        "companies": read_or_empty("companies.parquet", COMPANY_COLUMNS),
+        "matches": read_or_empty("matches.parquet", MATCH_COLUMNS),
+        "overrides": read_or_empty("overrides.csv", OVERRIDE_COLUMNS),
+        "wrong_nodes": read_or_empty("wrong_nodes.csv", WRONG_NODE_COLUMNS),
+        "ngram_index": ngram_index,
+    }
+
+
+def save_entity_index(index, index_path):
+    """
+    Function that writes the entity resolution index to its folder. The
+    overrides file is only created (empty) if it does not exist, as it is
+    edited by hand. The wrong nodes file holds the nodes read from it together
+    with the ones added when the index was built, so it keeps the hand edits.
+    """
+
+    os.makedirs(index_path, exist_ok=True)
+    write_file(index["companies"], f"{index_path}companies.parquet")
+    write_file(index["matches"], f"{index_path}matches.parquet")
+    write_file(index["wrong_nodes"], f"{index_path}wrong_nodes.csv")
+    with open(f"{index_path}ngram_index.pkl", "wb") as f:
+        pickle.dump(index["ngram_index"], f)
+    if not os.path.exists(f"{index_path}overrides.csv"):
+        write_file(index["overrides"], f"{index_path}overrides.csv")
+
+
+def add_overrides(index_path, overrides):
+    """
+    Function that adds manual decisions (target, company_name) to the overrides
+    of the index, a missing company_name means that the 13f name must not be
+    matched. The new decision replaces the earlier one for the same name.
+    """
+
+    index = load_entity_index(index_path)
+    overrides = pd.concat([index["overrides"], overrides[OVERRIDE_COLUMNS]])
+    overrides = overrides.drop_duplicates("target", keep="last")
+
+    os.makedirs(index_path, exist_ok=True)
+    write_file(overrides, f"{index_path}overrides.csv")
+
+
+def add_wrong_nodes(index, wrong_nodes):
+    """
+    Helper function that adds the 13f filers that report their holdings in
+    dollars (e.g. lists.wrong_nodes in the config) to the wrong nodes of the
+    index.
+    """
+
+    wrong_nodes = pd.DataFrame({"source": pd.Series(wrong_nodes, dtype=object)})
+    index["wrong_nodes"] = (
+        pd.concat([index["wrong_nodes"], wrong_nodes])
+        .drop_duplicates("source")
+        .reset_index(drop=True)
+    )
+
+    return index
+
+
+def get_wrong_nodes(index_path):
+    """
+    Function that returns the list of wrong nodes recorded in the index, their
+    values are divided by 1000 by normalize_edgelist.
+    """
+
+    return load_entity_index(index_path)["wrong_nodes"].source.tolist()
+
+
+def find_best_matches(
+    targets, companies, ngram_index=None, processes=None, max_in_flight=None
+):
+    """
+    Function that finds the most similar company for every 13f name among the
+    candidate pairs of the n-gram blocking. Returns a dataframe with the
+    company and the similarity for every name, names without candidates have
+    no company.
+    """
+
+    targets = pd.Series(targets, dtype=object).reset_index(drop=True)
+    if ngram_index is None:
+        ngram_index = create_ngram_index(companies.company_name)
+
+    def iter_tasks():
+        for chunk in chunks(targets, 1000):
+            candidates = generate_candidate_pairs(chunk, ngram_index).rename(
+                columns={"company_name": "target", "target": "company_name"}
+            )
+            for i in range(0, len(candidates), SIMILARITY_TASK_SIZE):
+                yield candidates.iloc[i : i + SIMILARITY_TASK_SIZE]
+
+    score = partial(calculate_similarity_df, None, None, top_k=1)
+    best = select_top_k(
+        score_in_parallel(score, iter_tasks(), processes, max_in_flight), 1
+    )
+    best = best.merge(companies[COMPANY_COLUMNS], on="company_name", how="left")
+
+    return pd.DataFrame({"target": targets}).merge(best, on="target", how="left")[
+        MATCH_COLUMNS
+    ]
+
+
+def resolve_names(
+    index_path,
+    companies,
+    targets,
+    processes=None,
+    max_in_flight=None,
+    save=True,
+    wrong_nodes=None,
+):
+    """
+    Function that resolves the 13f names to companies incrementally against the
+    persistent index. Only the names that are not in the index are scored
+    against every company, the known names are scored only against the new
+    companies and keep their match unless a new company is more similar. The
+    names matched to companies that no longer exist are scored again. The
+    given wrong nodes are added to the ones already in the index, so the manual
+    corrections are kept when the index is reused. Returns the index with the
+    updated matches.
+    """
+
+    start_time = time()
+    index = load_entity_index(index_path)
+    if wrong_nodes is not None:
+        index = add_wrong_nodes(index, wrong_nodes)
+    companies = companies[COMPANY_COLUMNS].drop_duplicates("company_name")
+    targets = pd.Series(targets, dtype=object).drop_duplicates()
+
+    known_companies = index["companies"]
+    new_companies = companies[
+        ~companies.company_name.isin(known_companies.company_name)
+    ]
+    removed = known_companies[
+        ~known_companies.company_name.isin(companies.company_name)
+    ]
+
+    matches = index["matches"]
+    matches = matches[~matches.company_name.isin(removed.company_name)]
+    unseen = targets[~targets.isin(matches.target)]
+    seen = targets[targets.isin(matches.target)]
+
+    ngram_index = index["ngram_index"]
+    if ngram_index is None or len(new_companies) or len(removed):
+        ngram_index = create_ngram_index(companies.company_name.reset_index(drop=True))
+
+    scored = find_best_matches(unseen, companies, ngram_index, processes, max_in_flight)
+    if len(new_companies) and len(seen):
+        # a new company can be a better match for the names that are known
+        rescored = find_best_matches(
+            seen, new_companies, None, processes, max_in_flight
+        )
+        old = matches.set_index("target").loc[rescored.target]
+        better = rescored.value.values > old.value.fillna(-1).values
+        matches = pd.concat(
+            [matches[~matches.target.isin(rescored.target[better])], rescored[better]]
+        )
+        logging.info(f"{better.sum()} known names are matched to new companies")
+
+    index["companies"] = companies.reset_index(drop=True)
+    index["matches"] = pd.concat([matches, scored], ignore_index=True).astype(
+        {"value": float}
+    )
+    index["ngram_index"] = ngram_index
+    if save:
+        save_entity_index(index, index_path)
+
+    logging.info(
+        f"{len(unseen)} new names are scored, {len(seen)} names are known, "
+        f"{len(new_companies)} new and {len(removed)} removed companies, "
+        f"resolution took {time() - start_time:.1f} seconds"
+    )
+
+    return index
+
+
+def get_resolved_matches(index, targets, threshold):
+    """
+    Function that returns the matches of the 13f names in the similarity
+    dataframe format (company_name, target, value): the scored matches with
+    similarity at least threshold, replaced by the manual overrides. Overridden
+    names get similarity 1, names overridden without company are dropped.
+    """
+
+    targets = pd.Series(targets, dtype=object)
+    overrides = index["overrides"]
+
+    matches = index["matches"]
+    matches = matches[
+        matches.target.isin(targets)
+        & ~matches.target.isin(overrides.target)
+        & (matches.value >= threshold)
+    ]
+
+    confirmed = overrides[
+        overrides.target.isin(targets) & overrides.company_name.notna()
+    ]
+    confirmed = confirmed.assign(value=1.0)
+
+    return pd.concat(
+        [
+            matches[["company_name", "target", "value"]],
+            confirmed[["company_name", "target", "value"]],
+        ],
+        ignore_index=True,
+    )
+
+
+def create_similarity_from_index(
+    node_temp_path,
+    edgelist_temp_path,
+    sim_path,
+    index_path,
+    threshold,
+    processes=None,
+    max_in_flight=None,
+    wrong_nodes=None,
+):
+    """
+    Function that resolves the 13f names of the standardized edgelist against
+    the persistent index and writes the matches to sim_path, in the same format
+    as create_similarity_file, so that create_node_info_and_filtered_edgelist can
+    use it. The wrong nodes are recorded in the index (see resolve_names).
+    """
+
+    financials = read_file(node_temp_path, columns=["identifier", "company_name"])
+    edgelist = read_file(edgelist_temp_path, columns=["target"])
+    companies = financials.rename(columns={"identifier": "company_id"})
+    targets = edgelist.target.drop_duplicates()
+
+    index = resolve_names(
+        index_path,
+        companies,
+        targets,
+        processes,
+        max_in_flight,
+        wrong_nodes=wrong_nodes,
+    )
+    sim_df = get_resolved_matches(index, targets, threshold)
+
+    write_file(sim_df, sim_path)
+    logging.info(f"{len(sim_df)} resolved names are written to {sim_path}")
+
+    return 1